@@ -0,0 +1,133 @@
+"""
+End-to-end task latency of the pool result delivery: the old 100 ms QTimer polling loop against the
+feeder thread that blocks on the shared results queue.
+
+Usage: python benchmarks/resultLatency.py [tasks] [workers]
+"""
+import sys
+from multiprocessing import Process, Queue
+from queue import Empty, Queue as HandOff
+from random import seed, uniform
+from threading import Thread
+from time import sleep, time
+
+POLLINTERVAL = 0.1
+ARRIVALGAP = 0.05
+MINWORK = 0.005
+MAXWORK = 0.05
+
+
+def work(tasks, results):
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        taskID, duration = task
+        sleep(duration)
+        results.put(taskID)
+
+
+def makeTasks(count):
+    seed(count)
+    return [(taskID, uniform(MINWORK, MAXWORK)) for taskID in range(count)]
+
+
+def polling(taskList, workers):
+    # mirrors the baseline Pool.update: a task per idle searcher on each tick, one get_nowait per searcher
+    locals = [Queue() for i in range(workers)]
+    remotes = [Queue() for i in range(workers)]
+    processes = [Process(target=work, args=(locals[i], remotes[i])) for i in range(workers)]
+    for p in processes:
+        p.start()
+
+    start = time()
+    arrivals = dict((taskID, start + taskID * ARRIVALGAP) for taskID, duration in taskList)
+    waiting = list(taskList)
+    queued = []
+    available = list(range(workers))
+    latencies = []
+    while len(latencies) < len(taskList):
+        sleep(POLLINTERVAL)
+        now = time()
+        while len(waiting) > 0 and arrivals[waiting[0][0]] <= now:
+            queued.append(waiting.pop(0))
+        while len(available) > 0 and len(queued) > 0:
+            locals[available.pop(0)].put(queued.pop(0))
+        for sid, remote in enumerate(remotes):
+            try:
+                taskID = remote.get_nowait()
+            except Empty:
+                continue
+            latencies.append(time() - arrivals[taskID])
+            available.append(sid)
+
+    for local in locals:
+        local.put(None)
+    for p in processes:
+        p.join()
+    return latencies
+
+
+def feeder(taskList, workers):
+    # mirrors TaskPool: one shared task queue, tasks sent on append and a thread waiting for results
+    tasks = Queue()
+    results = Queue()
+    handOff = HandOff()
+    processes = [Process(target=work, args=(tasks, results)) for i in range(workers)]
+    for p in processes:
+        p.start()
+
+    def feed():
+        while True:
+            result = results.get()
+            handOff.put(result)
+            if result is None:
+                return
+
+    thread = Thread(target=feed, daemon=True)
+    thread.start()
+
+    start = time()
+    arrivals = dict((taskID, start + taskID * ARRIVALGAP) for taskID, duration in taskList)
+    waiting = list(taskList)
+    latencies = []
+    while len(latencies) < len(taskList):
+        now = time()
+        while len(waiting) > 0 and arrivals[waiting[0][0]] <= now:
+            tasks.put(waiting.pop(0))
+        timeout = arrivals[waiting[0][0]] - now if len(waiting) > 0 else None
+        try:
+            taskID = handOff.get(timeout=timeout)
+        except Empty:
+            continue
+        latencies.append(time() - arrivals[taskID])
+
+    results.put(None)
+    thread.join()
+    for i in range(workers):
+        tasks.put(None)
+    for p in processes:
+        p.join()
+    return latencies
+
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print('{:<8} mean {:7.1f} ms   p50 {:7.1f} ms   p95 {:7.1f} ms   max {:7.1f} ms'.format(
+        name, mean * 1000, p50 * 1000, p95 * 1000, latencies[-1] * 1000))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    taskList = makeTasks(count)
+    print('{} tasks, {} searchers, one task every {} ms'.format(count, workers, int(ARRIVALGAP * 1000)))
+    summarize('polling', polling(taskList, workers))
+    summarize('feeder', feeder(taskList, workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Per-task setup cost of a Searcher: building a new YoutubeDL and search extractor for every task, as
+Searcher.run used to, against reusing the prepared pairs kept by Searcher.useDownloader.
+
+Usage: python benchmarks/searcherSetup.py [tasks]
+"""
+import sys
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from ytw.ParallellSearcher import SORTINGDICT, Searcher
+
+# (sorting, maxResults) of consecutive tasks: a few watched searches sharing one worker
+SETTINGS = ((1, 50), (1, 50), (0, 20), (1, 50), (1, 10), (0, 20))
+
+
+def rebuilt(searcher, tasks):
+    for i in range(tasks):
+        sorting, maxResults = SETTINGS[i % len(SETTINGS)]
+        searcher.searchOrder = SORTINGDICT[sorting]
+        searcher.searchMax = maxResults
+        searcher.downloader = searcher.createDownloader()
+        searcher.searchExtractor = searcher.createSearcher()
+
+
+def reused(searcher, tasks):
+    for i in range(tasks):
+        sorting, maxResults = SETTINGS[i % len(SETTINGS)]
+        searcher.useDownloader(SORTINGDICT[sorting], maxResults)
+
+
+def measure(name, function, tasks):
+    searcher = Searcher()
+    searcher.prepareDownloaders()
+    started = perf_counter()
+    function(searcher, tasks)
+    elapsed = perf_counter() - started
+    print('{:<8} {:8.3f} ms per task   {:8.3f} s total'.format(name, elapsed / tasks * 1000, elapsed))
+    return elapsed
+
+
+def main():
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print('{} tasks cycling through {} (sorting, maxResults) settings'.format(tasks, len(SETTINGS)))
+    before = measure('rebuilt', rebuilt, tasks)
+    after = measure('reused', reused, tasks)
+    print('speedup  {:.1f}x'.format(before / max(after, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
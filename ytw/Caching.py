@@ -0,0 +1,658 @@
+import sqlite3
+from collections import OrderedDict, deque
+from hashlib import sha1
+from json import dump, dumps, load, loads
+from os import listdir, makedirs, path, remove, rename, replace, rmdir, utime
+from threading import Condition, Lock, Thread
+from time import time
+
+from ._paths import cachedInfosPath, cachedThumbsPath, httpCachePath, searchesPath, videoInfosDBPath
+
+HTTPCACHEMAXBYTES = 100 * 1024 * 1024
+CACHEFILEEXT = '.cache'
+MIGRATIONBATCH = 500
+MIGRATEDSUFFIX = '.migrated'
+FLUSHINTERVAL = 2.0
+INFOSMEMORYBYTES = 16 * 1024 * 1024
+INFOSMAXBYTES = 256 * 1024 * 1024
+THUMBSMAXBYTES = 512 * 1024 * 1024
+CACHEMAXAGE = 90 * 24 * 60 * 60
+DERIVEDSUFFIX = '.small'
+TEMPEXT = '.tmp'
+DERIVEBATCH = 20
+BODYEXT = '.body'
+METAEXT = '.meta'
+
+
+class HTTPCache(object):
+    def __init__(self, cachePath=httpCachePath, maxBytes=HTTPCACHEMAXBYTES):
+        self.cachePath = cachePath
+        self.maxBytes = maxBytes
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._entries = None
+        self._totalBytes = 0
+        self._lock = Lock()
+
+    def getValidators(self, url):
+        with self._lock:
+            entry = self._getEntries().get(self._key(url))
+        if entry is None:
+            return {}
+        validators = {}
+        if entry['etag'] is not None:
+            validators['If-None-Match'] = entry['etag']
+        if entry['lastModified'] is not None:
+            validators['If-Modified-Since'] = entry['lastModified']
+        return validators
+
+    def getCachedBody(self, url):
+        key = self._key(url)
+        with self._lock:
+            entry = self._getEntries().get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._bodyPath(key), 'rb') as bodyFile:
+                    body = bodyFile.read()
+                entry['accessed'] = time()
+                utime(self._bodyPath(key))
+            except OSError:
+                self._removeEntry(key)
+                return None
+            self.stats['hits'] += 1
+            return body
+
+    def store(self, url, headers, body):
+        etag = headers.get('etag')
+        lastModified = headers.get('last-modified')
+        with self._lock:
+            self.stats['misses'] += 1
+            if etag is None and lastModified is None:
+                return
+            if len(body) > self.maxBytes:
+                return
+            key = self._key(url)
+            entries = self._getEntries()
+            if key in entries:
+                self._removeEntry(key)
+            try:
+                self._writeAtomically(self._bodyPath(key), body, 'wb')
+                meta = {'url': url, 'etag': etag, 'lastModified': lastModified}
+                self._writeAtomically(self._metaPath(key), meta, 'w')
+            except OSError as err:
+                print('HTTP cache write error', err)
+                return
+            entries[key] = {'etag': etag, 'lastModified': lastModified, 'size': len(body), 'accessed': time()}
+            self._totalBytes += len(body)
+            self.stats['stores'] += 1
+            self._evict()
+
+    def forget(self, url):
+        with self._lock:
+            key = self._key(url)
+            if key in self._getEntries():
+                self._removeEntry(key)
+
+    def getStats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._getEntries())
+            stats['bytes'] = self._totalBytes
+        return stats
+
+    def _getEntries(self):
+        if self._entries is not None:
+            return self._entries
+
+        self._entries = {}
+        self._totalBytes = 0
+        if not path.exists(self.cachePath):
+            makedirs(self.cachePath)
+        for fileName in listdir(self.cachePath):
+            key, ext = path.splitext(fileName)
+            if ext != METAEXT:
+                continue
+            try:
+                with open(self._metaPath(key)) as metaFile:
+                    meta = load(metaFile)
+                size = path.getsize(self._bodyPath(key))
+                accessed = path.getmtime(self._bodyPath(key))
+            except (OSError, ValueError):
+                self._removeFiles(key)
+                continue
+            self._entries[key] = {'etag': meta['etag'], 'lastModified': meta['lastModified'], 'size': size,
+                                  'accessed': accessed}
+            self._totalBytes += size
+        return self._entries
+
+    def _evict(self):
+        if self._totalBytes <= self.maxBytes:
+            return
+        byAccess = sorted(self._entries.items(), key=lambda item: item[1]['accessed'])
+        for key, entry in byAccess:
+            if self._totalBytes <= self.maxBytes:
+                break
+            self._removeEntry(key)
+            self.stats['evictions'] += 1
+
+    def _removeEntry(self, key):
+        entry = self._entries.pop(key)
+        self._totalBytes -= entry['size']
+        self._removeFiles(key)
+
+    def _removeFiles(self, key):
+        for filePath in (self._metaPath(key), self._bodyPath(key)):
+            try:
+                remove(filePath)
+            except OSError:
+                pass
+
+    def _writeAtomically(self, filePath, data, mode):
+        tempPath = filePath + '.tmp'
+        with open(tempPath, mode) as file:
+            if mode == 'wb':
+                file.write(data)
+            else:
+                dump(data, file)
+        replace(tempPath, filePath)
+
+    def _bodyPath(self, key):
+        return path.join(self.cachePath, key + BODYEXT)
+
+    def _metaPath(self, key):
+        return path.join(self.cachePath, key + METAEXT)
+
+    @staticmethod
+    def _key(url):
+        return sha1(url.encode('utf-8')).hexdigest()
+
+
+class VideoInfoStore(object):
+    TABLES = ('infos', 'thumbs')
+
+    def __init__(self, dbPath=videoInfosDBPath, legacyPath=cachedInfosPath, maxMemoryBytes=INFOSMEMORYBYTES):
+        createFolderIfAbscent(path.dirname(dbPath))
+        self.dbPath = dbPath
+        self.maxMemoryBytes = maxMemoryBytes
+        self._lock = Lock()
+        self._connection = sqlite3.connect(dbPath, check_same_thread=False)
+        self._unflushed = {}
+        self._touched = {}
+        self._memory = OrderedDict()
+        self._memoryBytes = 0
+        self._thumbFiles = {}
+        self._scannedFolders = set()
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS infos (id TEXT PRIMARY KEY, info TEXT NOT NULL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS thumbs (id TEXT PRIMARY KEY, path TEXT NOT NULL)')
+            for table in self.TABLES:
+                self._upgradeTable(table)
+        if legacyPath is not None and path.isdir(legacyPath):
+            self.migrate(legacyPath)
+
+    def _upgradeTable(self, table):
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info({})'.format(table))]
+        for column in ('size', 'accessed'):
+            if column not in columns:
+                self._connection.execute('ALTER TABLE {} ADD COLUMN {} REAL NOT NULL DEFAULT 0'.format(table, column))
+        if 'accessed' not in columns:
+            self._connection.execute('UPDATE {} SET accessed = ?'.format(table), (time(),))
+        if 'size' not in columns and table == 'infos':
+            self._connection.execute('UPDATE infos SET size = LENGTH(info)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS {0}_accessed ON {0} (accessed)'.format(table))
+
+    def get(self, videoID, default=None):
+        with self._lock:
+            self._touched[videoID] = time()
+            info = self._unflushed.get(videoID)
+            if info is not None:
+                return info
+            remembered = self._memory.get(videoID)
+            if remembered is not None:
+                self._memory.move_to_end(videoID)
+                return remembered[0]
+            row = self._connection.execute('SELECT info FROM infos WHERE id = ?', (videoID,)).fetchone()
+            if row is None:
+                return default
+            info = loads(row[0])
+            self._remember(videoID, info, len(row[0]))
+        return info
+
+    def __contains__(self, videoID):
+        with self._lock:
+            if videoID in self._unflushed or videoID in self._memory:
+                return True
+            row = self._connection.execute('SELECT 1 FROM infos WHERE id = ?', (videoID,)).fetchone()
+        return row is not None
+
+    def __getitem__(self, videoID):
+        info = self.get(videoID)
+        if info is None:
+            raise KeyError(videoID)
+        return info
+
+    def __setitem__(self, videoID, info):
+        self.putMany([(videoID, info)])
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM infos').fetchone()[0]
+
+    def touch(self, videoID):
+        with self._lock:
+            self._touched[videoID] = time()
+
+    def putMany(self, items):
+        now = time()
+        rows = []
+        for videoID, info in items:
+            text = dumps(info)
+            rows.append((videoID, text, len(text), now))
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO infos (id, info, size, accessed) VALUES (?, ?, ?, ?)',
+                                         rows)
+            for row in rows:
+                self._forget(row[0])
+
+    def putLater(self, videoID, info):
+        with self._lock:
+            self._unflushed[videoID] = info
+
+    def flushPending(self):
+        with self._lock:
+            pending = list(self._unflushed.items())
+        if len(pending) == 0:
+            return 0
+        self.putMany(pending)
+        with self._lock:
+            for videoID, info in pending:
+                if self._unflushed.get(videoID) is info:
+                    self._unflushed.pop(videoID)
+        return len(pending)
+
+    def flushTouched(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            rows = [(accessed, videoID) for videoID, accessed in touched.items()]
+            with self._connection:
+                for table in self.TABLES:
+                    self._connection.executemany('UPDATE {} SET accessed = ? WHERE id = ?'.format(table), rows)
+
+    def getThumbs(self, seedPath=cachedThumbsPath):
+        with self._lock:
+            rows = self._connection.execute('SELECT id, path FROM thumbs').fetchall()
+        if len(rows) == 0 and seedPath is not None:
+            thumbs = loadThumbsIndex(seedPath)
+            self.putThumbs(thumbs.items())
+            return thumbs
+        return dict(rows)
+
+    def _getThumbFiles(self, thumbPath):
+        folderPath = path.dirname(thumbPath)
+        if folderPath not in self._scannedFolders:
+            # listed once, files written afterwards are recorded by putThumbs and recordThumbFiles
+            self._scannedFolders.add(folderPath)
+            if path.isdir(folderPath):
+                for fileName in listdir(folderPath):
+                    if not fileName.endswith(TEMPEXT):
+                        filePath = path.join(folderPath, fileName)
+                        self._thumbFiles.setdefault(getThumbKey(filePath), set()).add(filePath)
+        return self._thumbFiles.setdefault(getThumbKey(thumbPath), set())
+
+    def recordThumbFiles(self, filePaths):
+        with self._lock:
+            for filePath in filePaths:
+                self._getThumbFiles(filePath).add(filePath)
+
+    def putThumbs(self, items):
+        now = time()
+        with self._lock:
+            groups = []
+            for videoID, thumbPath in items:
+                thumbFiles = self._getThumbFiles(thumbPath)
+                thumbFiles.add(thumbPath)
+                groups.append((videoID, thumbPath, list(thumbFiles)))
+        rows = []
+        for videoID, thumbPath, thumbFiles in groups:
+            size = 0
+            for filePath in thumbFiles:
+                try:
+                    size += path.getsize(filePath)
+                except OSError:
+                    pass
+            rows.append((videoID, thumbPath, size, now))
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO thumbs (id, path, size, accessed) VALUES (?, ?, ?, ?)',
+                                         rows)
+
+    def getByAccess(self, table):
+        with self._lock:
+            query = 'SELECT id, size, accessed FROM {} ORDER BY accessed'.format(table)
+            return self._connection.execute(query).fetchall()
+
+    def removeInfos(self, videoIDs):
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM infos WHERE id = ?', [(videoID,) for videoID in videoIDs])
+            for videoID in videoIDs:
+                self._forget(videoID)
+
+    def removeThumbs(self, videoIDs):
+        paths = []
+        with self._lock, self._connection:
+            for videoID in videoIDs:
+                row = self._connection.execute('SELECT path FROM thumbs WHERE id = ?', (videoID,)).fetchone()
+                if row is not None:
+                    thumbFiles = self._getThumbFiles(row[0])
+                    thumbFiles.add(row[0])
+                    paths.extend(thumbFiles)
+                    self._thumbFiles.pop(getThumbKey(row[0]))
+            self._connection.executemany('DELETE FROM thumbs WHERE id = ?', [(videoID,) for videoID in videoIDs])
+        return paths
+
+    def getOccupancy(self):
+        occupancy = {}
+        with self._lock:
+            for table in self.TABLES:
+                query = 'SELECT COUNT(*), TOTAL(size) FROM {}'.format(table)
+                entries, size = self._connection.execute(query).fetchone()
+                occupancy[table] = {'entries': entries, 'bytes': int(size)}
+            occupancy['memory'] = {'entries': len(self._memory), 'bytes': self._memoryBytes,
+                                   'maxBytes': self.maxMemoryBytes, 'unflushed': len(self._unflushed)}
+        return occupancy
+
+    def _remember(self, videoID, info, size):
+        self._forget(videoID)
+        if size > self.maxMemoryBytes:
+            return
+        self._memory[videoID] = (info, size)
+        self._memoryBytes += size
+        while self._memoryBytes > self.maxMemoryBytes:
+            forgottenID, (forgotten, forgottenSize) = self._memory.popitem(last=False)
+            self._memoryBytes -= forgottenSize
+
+    def _forget(self, videoID):
+        remembered = self._memory.pop(videoID, None)
+        if remembered is not None:
+            self._memoryBytes -= remembered[1]
+
+    def migrate(self, legacyPath):
+        batch = []
+        for fileName in listdir(legacyPath):
+            videoID, ext = path.splitext(fileName)
+            try:
+                with open(path.join(legacyPath, fileName)) as info:
+                    batch.append((videoID[1:], load(info)))
+            except (OSError, ValueError) as err:
+                print('Skipped cached info', fileName, err)
+                continue
+            if len(batch) >= MIGRATIONBATCH:
+                self.putMany(batch)
+                batch = []
+        self.putMany(batch)
+        migratedPath = legacyPath + MIGRATEDSUFFIX
+        if not path.exists(migratedPath):
+            rename(legacyPath, migratedPath)
+            return
+        # an older build recreated the folder after a previous migration
+        print('Merging cached infos into', migratedPath)
+        try:
+            for fileName in listdir(legacyPath):
+                replace(path.join(legacyPath, fileName), path.join(migratedPath, fileName))
+            rmdir(legacyPath)
+        except OSError as err:
+            print('Cached infos merge error', err)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CacheManager(object):
+    def __init__(self, store, thumbsCache, maxInfoBytes=INFOSMAXBYTES, maxThumbBytes=THUMBSMAXBYTES,
+                 maxAge=CACHEMAXAGE, onThumbsEvicted=None):
+        self.store = store
+        self.thumbsCache = thumbsCache
+        self.onThumbsEvicted = onThumbsEvicted
+        self.maxBytes = {'infos': maxInfoBytes, 'thumbs': maxThumbBytes}
+        self.maxAge = maxAge
+        self.stats = {'infos': 0, 'thumbs': 0, 'runs': 0}
+
+    def evict(self, protected=()):
+        # protected videos are the ones shown by a live search, they are never evicted
+        protected = set(protected)
+        self.store.flushTouched()
+        expiredBefore = time() - self.maxAge
+        for table in self.store.TABLES:
+            entries = self.store.getByAccess(table)
+            total = sum(size for videoID, size, accessed in entries)
+            victims = []
+            for videoID, size, accessed in entries:
+                if total <= self.maxBytes[table] and accessed >= expiredBefore:
+                    break
+                if videoID in protected:
+                    continue
+                victims.append(videoID)
+                total -= size
+            if len(victims) == 0:
+                continue
+            if table == 'infos':
+                self.store.removeInfos(victims)
+                self.stats['infos'] += len(victims)
+            elif self.onThumbsEvicted is not None:
+                # thumbsCache belongs to the caller's thread, it releases the victims still unused there
+                self.onThumbsEvicted(victims)
+            else:
+                self.removeThumbs(self.releaseThumbs(victims))
+        self.stats['runs'] += 1
+
+    def releaseThumbs(self, videoIDs, protected=()):
+        released = [videoID for videoID in videoIDs if videoID not in protected]
+        for videoID in released:
+            self.thumbsCache.pop(videoID, None)
+        return released
+
+    def removeThumbs(self, videoIDs):
+        self.stats['thumbs'] += len(videoIDs)
+        for filePath in self.store.removeThumbs(videoIDs):
+            try:
+                remove(filePath)
+            except OSError:
+                pass
+
+    def getOccupancy(self):
+        occupancy = self.store.getOccupancy()
+        for table in self.store.TABLES:
+            occupancy[table]['maxBytes'] = self.maxBytes[table]
+        occupancy['evicted'] = dict(self.stats)
+        return occupancy
+
+
+class PersistenceQueue(Thread):
+    def __init__(self, store, interval=FLUSHINTERVAL, cacheManager=None, deriver=None, onThumbsDerived=None):
+        super(PersistenceQueue, self).__init__(name='Persistence')
+        self.daemon = True
+        self.store = store
+        self.interval = interval
+        self.cacheManager = cacheManager
+        self.deriver = deriver
+        self.onThumbsDerived = onThumbsDerived
+        self._toDerive = deque()
+        self._protected = None
+        self._condition = Condition()
+        self._thumbs = {}
+        self._evictedThumbs = set()
+        self._settings = {}
+        self._requested = 0
+        self._completed = 0
+        self._isRunning = True
+
+    def putVideoInfo(self, videoID, info):
+        self.store.putLater(videoID, info)
+
+    def putThumb(self, videoID, thumbPath):
+        with self._condition:
+            self._thumbs[videoID] = thumbPath
+
+    def removeThumbs(self, videoIDs):
+        with self._condition:
+            self._evictedThumbs.update(videoIDs)
+
+    def deriveThumbs(self, items):
+        if self.deriver is None:
+            return
+        with self._condition:
+            self._toDerive.extend(items)
+            self._condition.notify_all()
+
+    def putSearchSettings(self, word, settings):
+        with self._condition:
+            self._settings[word] = settings
+
+    def removeSearchSettings(self, word):
+        with self._condition:
+            self._settings[word] = None
+
+    def requestEviction(self, protected):
+        with self._condition:
+            self._protected = set(protected)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        if not self.is_alive():
+            self._write()
+            return
+        with self._condition:
+            self._requested += 1
+            target = self._requested
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._completed >= target, timeout)
+
+    def stop(self):
+        with self._condition:
+            self._isRunning = False
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join()
+        else:
+            self._write()
+
+    def run(self):
+        while True:
+            with self._condition:
+                if (self._isRunning and self._completed >= self._requested and self._protected is None and
+                        len(self._toDerive) == 0):
+                    self._condition.wait(self.interval)
+                target = self._requested
+                isRunning = self._isRunning
+            self._write()
+            with self._condition:
+                self._completed = target
+                self._condition.notify_all()
+            if not isRunning:
+                return
+            self._deriveThumbs()
+
+    def _deriveThumbs(self):
+        with self._condition:
+            batch = [self._toDerive.popleft() for i in range(min(DERIVEBATCH, len(self._toDerive)))]
+        derived = []
+        for videoID, thumbPath in batch:
+            try:
+                derivedPath = self.deriver(thumbPath)
+            except Exception as err:
+                print('Thumbnail derivative error', err)
+                continue
+            if derivedPath != thumbPath:
+                derived.append((videoID, derivedPath))
+        if len(derived) > 0 and self.onThumbsDerived is not None:
+            self.onThumbsDerived(derived)
+
+    def _write(self):
+        with self._condition:
+            thumbs, self._thumbs = self._thumbs, {}
+            evictedThumbs, self._evictedThumbs = self._evictedThumbs, set()
+            settings, self._settings = self._settings, {}
+            protected, self._protected = self._protected, None
+        try:
+            self.store.flushPending()
+            if len(thumbs) > 0:
+                self.store.putThumbs(thumbs.items())
+        except sqlite3.Error as err:
+            print('Persistence error', err)
+            with self._condition:
+                for videoID, thumbPath in thumbs.items():
+                    self._thumbs.setdefault(videoID, thumbPath)
+        # a thumbnail downloaded again after its eviction was confirmed is kept
+        evictedThumbs.difference_update(thumbs.keys())
+        if len(evictedThumbs) > 0 and self.cacheManager is not None:
+            try:
+                self.cacheManager.removeThumbs(list(evictedThumbs))
+            except sqlite3.Error as err:
+                print('Cache eviction error', err)
+        for word, wordSettings in settings.items():
+            try:
+                if wordSettings is None:
+                    removeSearchSettings(word)
+                else:
+                    dumpSearchSettings(word, wordSettings)
+            except OSError as err:
+                print('Persistence error', err)
+        if protected is not None and self.cacheManager is not None:
+            try:
+                self.cacheManager.evict(protected)
+            except sqlite3.Error as err:
+                print('Cache eviction error', err)
+
+
+def createFolderIfAbscent(folderPath):
+    if not path.exists(folderPath):
+        makedirs(folderPath)
+
+
+def isDerivedThumb(thumbPath):
+    return DERIVEDSUFFIX + '.' in path.basename(thumbPath)
+
+
+def getThumbKey(thumbPath):
+    # the original download and its derivatives share the '_<id>_thumb' prefix
+    return path.join(path.dirname(thumbPath), path.basename(thumbPath).split('_thumb')[0])
+
+
+def loadThumbsIndex(folderPath=cachedThumbsPath):
+    createFolderIfAbscent(folderPath)
+    thumbs = {}
+    for fileName in listdir(folderPath):
+        if fileName.endswith(TEMPEXT):
+            continue
+        videoID = fileName.split('_thumb')[0][1:]
+        if videoID in thumbs and not isDerivedThumb(fileName):
+            continue
+        thumbs[videoID] = path.join(folderPath, fileName)
+    return thumbs
+
+
+def loadSearchSettings(folderPath=searchesPath):
+    createFolderIfAbscent(folderPath)
+    searches = []
+    for fileName in listdir(folderPath):
+        word, ext = path.splitext(fileName)
+        if ext != CACHEFILEEXT:
+            continue
+        with open(path.join(folderPath, fileName)) as info:
+            searches.append((word[1:], load(info)))
+    searches.sort(key=lambda search: search[1].get('index', 0))
+    return searches
+
+
+def dumpSearchSettings(word, settings, folderPath=searchesPath):
+    createFolderIfAbscent(folderPath)
+    filePath = path.join(folderPath, '_' + word + CACHEFILEEXT)
+    with open(filePath + '.tmp', 'w') as file:
+        dump(settings, file, indent=4)
+    replace(filePath + '.tmp', filePath)
+
+
+def removeSearchSettings(word, folderPath=searchesPath):
+    filePath = path.join(folderPath, '_' + word + CACHEFILEEXT)
+    if path.exists(filePath):
+        remove(filePath)
@@ -1,30 +1,109 @@
 # from .youtube_dl.utils import YoutubeDLError, DownloadError
 
+from os import getpid, path
+from threading import Lock
+from urllib.parse import urljoin
+
 import urllib3 as ulib
 import certifi
 
+from .Caching import HTTPCache
+from ._paths import cachedThumbsPath
+
 MAXTRIES = 5
+MAXHOSTPOOLS = 10
+DEFAULTPOOLSIZE = 4
+HOSTPOOLSIZES = {'i.ytimg.com': 32, 'i9.ytimg.com': 32}
+HEADERS = {'user-agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:54.0) Gecko/20100101 Firefox/54.0'}
+
+_managerLock = Lock()
+_manager = None
+_managerPID = None
+_disposedStats = {'opened': 0, 'requests': 0}
+_httpCache = None
+
+
+def getPoolManager():
+    global _manager, _managerPID
+    with _managerLock:
+        pid = getpid()
+        if _manager is None or _managerPID != pid:
+            # a manager inherited through fork would share sockets with the parent
+            _manager = ulib.PoolManager(num_pools=MAXHOSTPOOLS, maxsize=DEFAULTPOOLSIZE, block=False,
+                                        cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(), retries=False)
+            _manager.pools.dispose_func = _disposeHostPool
+            _managerPID = pid
+            _disposedStats['opened'] = _disposedStats['requests'] = 0
+        return _manager
+
+
+def getHTTPCache():
+    global _httpCache
+    with _managerLock:
+        if _httpCache is None:
+            _httpCache = HTTPCache()
+        return _httpCache
+
 
+def _disposeHostPool(hostPool):
+    with _managerLock:
+        _disposedStats['opened'] += hostPool.num_connections
+        _disposedStats['requests'] += hostPool.num_requests
+    hostPool.close()
 
-def download(url, retryNumber=0):
-    headers = {'user-agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:54.0) Gecko/20100101 Firefox/54.0'}
-    host = ulib.get_host(url)
-    fullhost = host[0] + '://' + host[1]
-    con = ulib.connection_from_url(fullhost, cert_reqs='CERT_REQUIRED', ca_certs=certifi.where(),
-                                   retries=False)
-    file = url.replace(fullhost, '', 1)
+
+def getConnectionStats():
+    manager = getPoolManager()
+    with _managerLock:
+        opened = _disposedStats['opened']
+        requests = _disposedStats['requests']
+    for key in manager.pools.keys():
+        hostPool = manager.pools.get(key)
+        if hostPool is not None:
+            opened += hostPool.num_connections
+            requests += hostPool.num_requests
+    return {'opened': opened, 'reused': max(requests - opened, 0), 'requests': requests}
+
+
+def download(url, retryNumber=0, useCache=False):
+    manager = getPoolManager()
+    cache = getHTTPCache() if useCache else None
+    headers = dict(HEADERS)
+    if cache is not None:
+        headers.update(cache.getValidators(url))
+    parsedURL = ulib.util.parse_url(url)
+    poolSize = HOSTPOOLSIZES.get(parsedURL.host, DEFAULTPOOLSIZE)
+    con = manager.connection_from_url(url, pool_kwargs={'maxsize': poolSize})
     try:
-        result = con.request('GET', file, headers=headers)
+        result = con.urlopen('GET', parsedURL.request_uri, headers=headers, redirect=False, retries=False)
         status = result.status
         if 200 <= status < 300:
+            if cache is not None:
+                cache.store(url, result.headers, result.data)
             return result.data
-        elif 399 < status < 500:
-            raise RuntimeError('Error {}'.format(status))
+        elif status == 304 and cache is not None:
+            data = cache.getCachedBody(url)
+            if data is None:
+                cache.forget(url)
+                return download(url, retryNumber, useCache)
+            return data
         elif status in result.REDIRECT_STATUSES:
             if retryNumber >= MAXTRIES:
                 raise RuntimeError('Max retries reached.')
-            return download(result.headers['location'], retryNumber+1)
+            return download(urljoin(url, result.headers['location']), retryNumber + 1, useCache)
+        else:
+            raise RuntimeError('Error {}'.format(status))
     except ulib.exceptions.HTTPError as err:
         raise RuntimeError('URL: {} error:{}'.format(url, err))
-    except Exception:
-        raise
+
+
+def downloadThumbnail(thumbURL, videoID):
+    binaryThumb = download(thumbURL, useCache=True)
+    thumbExt = path.splitext(path.basename(thumbURL))[1]
+    thumbPath = path.join(cachedThumbsPath, '_' + videoID + '_thumb' + thumbExt)
+    try:
+        with open(thumbPath, 'xb') as thumbFile:
+            thumbFile.write(binaryThumb)
+    except FileExistsError:
+        pass
+    return videoID, thumbPath
@@ -0,0 +1,1367 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from heapq import heapify, heappop, heappush
+from itertools import count
+from multiprocessing import cpu_count
+from queue import Full
+from random import uniform
+from re import IGNORECASE, compile as compileRegex, escape
+from signal import SIGTERM
+from threading import Thread
+from time import time
+
+from .Caching import CacheManager, PersistenceQueue, VideoInfoStore, isDerivedThumb, loadSearchSettings
+from .Downloading import downloadThumbnail, getConnectionStats, getHTTPCache
+from .Metrics import PoolMetrics, dumpMetrics
+from .ParallellSearcher import (CANCELLEDSLOTS, DEFAULTRATEKEY, RATELIMITS, THUMBSHOST, WORKERCONTEXT, ErrorTypesEnum,
+                                RemoteError, Searcher, TaskResult, TaskTypesEnum)
+from .RateLimiting import RateLimiter, isThrottlingError
+from ._paths import metricsPath
+
+
+PREFETCHPERSEARCHER = 2
+MINSEARCHERS = 1
+MAINTENANCEINTERVAL = 2000
+SCALEUPTICKS = 2
+SCALEDOWNTICKS = 15
+SCALINGCOOLDOWN = 5.0
+SCALEUPWAIT = 10.0
+LATENCYSMOOTHING = 0.2
+MAXTASKATTEMPTS = 3
+MINTASKTIMEOUT = 60
+METRICSDUMPINTERVAL = 60
+CACHEMAINTENANCEINTERVAL = 10 * 60 * 1000
+
+VIDEOBATCHSIZE = 10
+THUMBCONCURRENCY = 32
+
+TASKPRIORITIES = {TaskTypesEnum.word: 0, TaskTypesEnum.video: 1, TaskTypesEnum.videos: 1, TaskTypesEnum.thumb: 2,
+                  TaskTypesEnum.data: 3}
+COALESCEDTYPES = (TaskTypesEnum.video, TaskTypesEnum.videos, TaskTypesEnum.thumb)
+FOCUSBONUS = 1.5
+AGINGSECONDS = 5.0
+
+ARRIVALSMOOTHING = 0.3
+TARGETARRIVALS = 1.0
+MAXADAPTIVESECONDS = 60 * 60
+
+MAXCONCURRENTSEARCHES = 4
+STARTJITTER = 10.0
+INTERVALJITTER = 0.1
+
+
+class SearchStatesEnum(object):
+    paused = 'paused'
+    readyToSearch = 'ready'
+    error = 'error'
+
+
+class SortingEnum(object):
+    views = 'Views'
+    likes = 'Likes'
+    newest = 'Newest'
+    oldest = 'Oldest'
+    lenght = 'Lenght'
+
+
+class ExclusionMatcher(object):
+    FIELDS = ('title', 'uploader')
+
+    def __init__(self, terms=()):
+        terms = set(term.strip() for term in terms)
+        terms.discard('')
+        self.terms = sorted(terms, key=len, reverse=True)
+        if len(self.terms) > 0:
+            self.pattern = compileRegex('|'.join(escape(term) for term in self.terms), IGNORECASE)
+        else:
+            self.pattern = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def matches(self, entry):
+        if self.pattern is None:
+            return False
+        for field in self.FIELDS:
+            value = entry.get(field)
+            if value and self.pattern.search(value) is not None:
+                return True
+        return False
+
+
+class WatchedSearch(object):
+    def __init__(self, videoInfosCache, thumbsCache, baseCallback, thumbsCallback, pool, word='', excludeds=None,
+                 status=SearchStatesEnum.readyToSearch):
+        self.thumbsCallback = thumbsCallback
+        self.thumbsCache = thumbsCache
+        self.videoInfosCache = videoInfosCache
+        if excludeds is None:
+            excludeds = []
+        self.word = word
+        self._excludeds = []
+        self.exclusions = ExclusionMatcher()
+        self.excludeds = excludeds
+        self.status = status
+        self.index = -1
+        self._miliseconds = 2 * 60 * 1000
+        self.baseCallback = baseCallback
+        self.currentResults = {}
+        self.allResults = {}
+
+        self.unit = 'minutes'
+        self._lastFoundCount = 0
+        self._recentIDs = []
+        self.incremental = True
+        self.adaptive = False
+        self.maxSeconds = MAXADAPTIVESECONDS
+        self.arrivalRate = None
+        self._lastPollAt = None
+
+        self._isFirstRun = True
+        self.error = None
+        self._externalPause = False
+
+        self._searchMode = 1
+        self._maxResults = 50
+
+        self.pool = pool
+
+        self._isSearching = False
+        self._isRead = True
+
+        self._sorting = SortingEnum.newest
+
+        self.task = PoolableTask(self._searchMode, self._maxResults, word)
+
+    @property
+    def sorting(self):
+        return self._sorting
+
+    @sorting.setter
+    def sorting(self, value):
+        self._sorting = value
+
+    @property
+    def maxResults(self):
+        return self._maxResults
+
+    @maxResults.setter
+    def maxResults(self, value):
+        self._maxResults = value
+        self.task.maxResults = value
+
+    @property
+    def excludeds(self):
+        return self._excludeds
+
+    @excludeds.setter
+    def excludeds(self, value):
+        self._excludeds = value
+        self.exclusions = ExclusionMatcher(value)
+        self._excludedIDs = set()
+
+    @property
+    def fullInfo(self):
+        return self.task.fullInfo
+
+    @fullInfo.setter
+    def fullInfo(self, value):
+        self.task.fullInfo = value
+
+    @property
+    def isRead(self):
+        return self._isRead
+
+    @isRead.setter
+    def isRead(self, value):
+        self._isRead = value
+
+    def isSearching(self):
+        return self._isSearching
+
+    @property
+    def seconds(self):
+        return int(self._miliseconds / 1000)
+
+    @property
+    def taskTimeout(self):
+        return max(self.seconds, MINTASKTIMEOUT)
+
+    @property
+    def currentSeconds(self):
+        if not self.adaptive or self.arrivalRate is None:
+            return self.seconds
+        slowest = max(self.seconds, self.maxSeconds)
+        if self.arrivalRate <= 0:
+            return slowest
+        return int(min(max(TARGETARRIVALS / self.arrivalRate, self.seconds), slowest))
+
+    @property
+    def predictedArrivals(self):
+        if self.arrivalRate is None:
+            return None
+        return self.arrivalRate * self.currentSeconds
+
+    def _observeArrivals(self, newCount):
+        now = time()
+        if self._lastPollAt is not None:
+            rate = newCount / max(now - self._lastPollAt, 1.0)
+            if self.arrivalRate is None:
+                self.arrivalRate = rate
+            else:
+                self.arrivalRate += (rate - self.arrivalRate) * ARRIVALSMOOTHING
+            self.onIntervalChanged()
+        self._lastPollAt = now
+
+    @seconds.setter
+    def seconds(self, value):
+        self._miliseconds = value * 1000
+        self.resetTimer()
+
+    def __repr__(self):
+        return '\'{}\' , {} exclusions, {}'.format(self.word, len(self.excludeds), self.status)
+
+    def _startTimer(self, miliseconds):
+        self.pool.scheduler.schedule(self, miliseconds / 1000)
+
+    def _stopTimer(self):
+        self.pool.scheduler.unschedule(self)
+
+    def _setIdle(self):
+        self._isSearching = False
+        self.pool.scheduler.searchFinished(self)
+
+    def onSearchError(self, errorType, errorData):
+        print('Error while searching for \'{}\': {}'.format(self.word, errorData))
+        if self._isSearching:
+            self.setSearchFinished()
+
+    def onShutdownRequired(self, reason):
+        print('Search for \'{}\' stopped: {}'.format(self.word, reason))
+
+    def onIntervalChanged(self):
+        pass
+
+    def _performSearch(self):
+        self.setSearching()
+        task = self.task(self.word, TaskTypesEnum.word)
+        if self.incremental and self._searchMode == 1:
+            # only videos that were really handled, anything else has to be searched for again
+            task.knownIDs = tuple(videoID for videoID in self._recentIDs
+                                  if videoID in self.allResults or videoID in self._excludedIDs)
+        self.pool.appendTask(task, self._resultsCallback, self.taskTimeout)
+
+    def _resultsCallback(self, returnValue):
+        if not isinstance(returnValue, TaskResult):
+            self.terminate()
+            self.onShutdownRequired('Return value is not of class \'TaskResult\'')
+            return
+
+        result = returnValue.data
+        taskType = returnValue.taskType
+
+        if taskType == TaskTypesEnum.error:
+            if result.errorType == ErrorTypesEnum.Expired:
+                if self._isSearching:
+                    self.setSearchFinished()
+            else:
+                self.onSearchError(result.errorType, result.errorData)
+
+        elif taskType == TaskTypesEnum.word:
+            self._lastFoundCount = len(result['entries'])
+            foundIDs = [video['id'] for video in result['entries']]
+            found = set(foundIDs)
+            self._recentIDs = foundIDs + [videoID for videoID in self._recentIDs if videoID not in found]
+            del self._recentIDs[self._maxResults:]
+            self._excludedIDs.intersection_update(self._recentIDs)
+            self._observeArrivals(len([videoID for videoID in foundIDs if videoID not in self.allResults]))
+
+            videoURLs = []
+            for video in result['entries']:
+                videoID = video['id']
+                if videoID in self.allResults.keys():
+                    continue
+                if self.exclusions.matches(video):
+                    self._excludedIDs.add(videoID)
+                    continue
+                cachedVideoResult = self.videoInfosCache.get(videoID)
+                if cachedVideoResult is None:
+                    videoURLs.append(video['url'])
+                else:
+                    self._resultsCallback(TaskResult(cachedVideoResult, TaskTypesEnum.video))
+
+            if len(videoURLs) == 0:
+                self.setSearchFinished()
+            for i in range(0, len(videoURLs), VIDEOBATCHSIZE):
+                batch = videoURLs[i:i + VIDEOBATCHSIZE]
+                self.pool.appendTask(self.task(batch, TaskTypesEnum.videos), self._resultsCallback, self.taskTimeout)
+        elif taskType == TaskTypesEnum.videos:
+            if len(result) == 0 and self._isSearching:
+                self.setSearchFinished()
+            for videoURL, videoInfo in result:
+                self._resultsCallback(TaskResult(videoInfo, TaskTypesEnum.video))
+        elif taskType == TaskTypesEnum.video:
+            self._lastFoundCount -= 1
+            if self._lastFoundCount >= 0:
+                self.setReady()
+            videoID = result['id']
+            if self.exclusions.matches(result):
+                self._excludedIDs.add(videoID)
+                return
+            self.currentResults[videoID] = result
+            self.allResults[videoID] = result
+            if videoID not in self.thumbsCache.keys():
+                thumbURL = result['thumbnail']
+                self.pool.appendTask(self.task((thumbURL, videoID), TaskTypesEnum.thumb), self._thumbCallback)
+
+            self.isRead = False
+            self.baseCallback(self.word, result)
+
+    def _thumbCallback(self, returnValue):
+        # thumbnails don't belong to the running poll, their errors must not finish it
+        if returnValue.taskType == TaskTypesEnum.error:
+            print('Thumbnail error for \'{}\': {}'.format(self.word, returnValue.data.errorData))
+            return
+        self.thumbsCallback(returnValue.data)
+
+    def setSearching(self):
+        self._stopTimer()
+        self._isSearching = True
+        self.pool.scheduler.searchStarted(self)
+
+    def setReady(self):
+        self._setIdle()
+        self.status = SearchStatesEnum.readyToSearch
+        if self._isFirstRun:
+            self._isFirstRun = False
+            self.pool.scheduler.schedule(self, 0, STARTJITTER)
+        else:
+            self._startTimer(self.currentSeconds * 1000)
+
+    def setSearchFinished(self):
+        if self.status != SearchStatesEnum.paused:
+            self.setReady()
+        else:
+            self._setIdle()
+
+    def resetTimer(self):
+        self._stopTimer()
+        if self.status != SearchStatesEnum.paused:
+            self._startTimer(self.currentSeconds * 1000)
+
+    @property
+    def searchMode(self):
+        return self._searchMode
+
+    @searchMode.setter
+    def searchMode(self, value):
+        if value != self._searchMode:
+            self._recentIDs = []
+            self._excludedIDs = set()
+        self._searchMode = value
+        self.task.sorting = value
+
+    def forceSearchNow(self):
+        self._performSearch()
+
+    def setPaused(self):
+        self._stopTimer()
+        self.status = SearchStatesEnum.paused
+        self.pool.cancelTasks(self.word)
+        self._setIdle()
+
+    def terminate(self):
+        self._stopTimer()
+        self.pool.cancelTasks(self.word)
+        self._setIdle()
+
+    def getSettings(self):
+        return {'seconds': self.seconds, 'status': self.status, 'excludeds': self.excludeds, 'unit': self.unit,
+                'index': self.index, 'searchMode': self.searchMode, 'max': self.maxResults, 'sorting': self.sorting,
+                'fullInfo': self.fullInfo, 'incremental': self.incremental, 'adaptive': self.adaptive,
+                'maxSeconds': self.maxSeconds}
+
+    def applySettings(self, settings):
+        self.seconds = settings.get('seconds', self.seconds)
+        self.excludeds = settings.get('excludeds', self.excludeds)
+        self.unit = settings.get('unit', self.unit)
+        self.maxResults = settings.get('max', self.maxResults)
+        self.searchMode = settings.get('searchMode', self.searchMode)
+        self.sorting = settings.get('sorting', self.sorting)
+        self.fullInfo = settings.get('fullInfo', self.fullInfo)
+        self.incremental = settings.get('incremental', self.incremental)
+        self.adaptive = settings.get('adaptive', self.adaptive)
+        self.maxSeconds = settings.get('maxSeconds', self.maxSeconds)
+
+    def _externalPause(self, state):
+        self.queue.put_nowait(state)
+
+
+class PoolableTask(object):
+    def __init__(self, sorting, maxResults, owner=None):
+        self.sorting = sorting
+        self.maxResults = maxResults
+        self.owner = owner
+        self.task = None
+        self.taskType = None
+        self.taskID = None
+        self.enqueuedAt = None
+        self.dispatchedAt = None
+        self.attempts = 0
+        self.deadline = None
+        self.cancelled = False
+        self.fullInfo = False
+        self.knownIDs = None
+        self.flightKeys = []
+
+    def __call__(self, task, taskType):
+        newTask = PoolableTask(self.sorting, self.maxResults, self.owner)
+        newTask.fullInfo = self.fullInfo
+        newTask.task = task
+        newTask.taskType = taskType
+        return newTask
+
+    def __repr__(self):
+        return str(self.task) + '-' + str(self.taskType)
+
+    def __getitem__(self, item):
+        if item == 0:
+            return self.task
+        elif item == 1:
+            return self.taskType
+        else:
+            raise IndexError('wrong index for task')
+
+
+class TaskHandle(object):
+    def __init__(self, pool, task):
+        self.pool = pool
+        self.task = task
+
+    @property
+    def deadline(self):
+        return self.task.deadline
+
+    @property
+    def isCancelled(self):
+        return self.task.cancelled
+
+    def cancel(self):
+        self.pool.cancelTask(self.task)
+
+
+class TaskScheduler(object):
+    def __init__(self):
+        self.queues = {}
+        self.heads = {}
+        self.heaps = {}
+        self.depths = {}
+        self.focusedOwner = None
+        self._count = 0
+        self._sequence = count()
+
+    def __len__(self):
+        return self._count
+
+    def setFocusedOwner(self, owner):
+        self.focusedOwner = owner
+
+    def push(self, task, callback):
+        if task.enqueuedAt is None:
+            task.enqueuedAt = time()
+        queue = self._getQueue(task)
+        queue.append((task, callback))
+        if len(queue) == 1:
+            self._setHead((task.taskType, task.owner))
+        self._changeDepth(task.taskType, 1)
+
+    def pushFront(self, task, callback):
+        self._getQueue(task).appendleft((task, callback))
+        self._setHead((task.taskType, task.owner))
+        self._changeDepth(task.taskType, 1)
+
+    def pop(self):
+        now = time()
+        bestKey = None
+        bestScore = None
+        for taskType in self.heaps.keys():
+            # the oldest head wins within a type unless the focused owner's head beats it with its bonus
+            for key in (self._getOldestKey(taskType), (taskType, self.focusedOwner)):
+                queue = self.queues.get(key)
+                if queue is None:
+                    continue
+                score = self._score(queue[0][0], now)
+                if bestScore is None or score < bestScore:
+                    bestKey = key
+                    bestScore = score
+
+        if bestKey is None:
+            return None
+
+        queue = self.queues[bestKey]
+        task, callback = queue.popleft()
+        if len(queue) == 0:
+            self.queues.pop(bestKey)
+            self.heads.pop(bestKey)
+        else:
+            self._setHead(bestKey)
+        self._changeDepth(task.taskType, -1)
+        return task, callback
+
+    def iterTasks(self):
+        for queue in self.queues.values():
+            for task, callback in queue:
+                yield task
+
+    def getDepths(self):
+        return dict(self.depths)
+
+    def _score(self, task, now):
+        # waiting AGINGSECONDS is worth one priority class, so newer tasks can't starve older ones
+        score = TASKPRIORITIES.get(task.taskType, len(TASKPRIORITIES))
+        if task.owner is not None and task.owner == self.focusedOwner:
+            score -= FOCUSBONUS
+        return score - (now - task.enqueuedAt) / AGINGSECONDS
+
+    def _setHead(self, key):
+        entry = [self.queues[key][0][0].enqueuedAt, next(self._sequence), key]
+        self.heads[key] = entry
+        heap = self.heaps.setdefault(key[0], [])
+        heappush(heap, entry)
+        if len(heap) > 2 * len(self.heads) + 16:
+            heap[:] = [queued for queued in heap if self.heads.get(queued[2]) is queued]
+            heapify(heap)
+
+    def _getOldestKey(self, taskType):
+        heap = self.heaps[taskType]
+        while len(heap) > 0 and self.heads.get(heap[0][2]) is not heap[0]:
+            heappop(heap)
+        if len(heap) == 0:
+            return None
+        return heap[0][2]
+
+    def _getQueue(self, task):
+        key = (task.taskType, task.owner)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+        return queue
+
+    def _changeDepth(self, taskType, amount):
+        self.depths[taskType] = self.depths.get(taskType, 0) + amount
+        self._count += amount
+
+
+class SearchScheduler(object):
+    def __init__(self, maxConcurrent=MAXCONCURRENTSEARCHES):
+        self.maxConcurrent = maxConcurrent
+        self.heap = []
+        self.entries = {}
+        self.running = set()
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, search, seconds, spread=None):
+        self.unschedule(search)
+        if spread is None:
+            # jitter keeps searches created together from polling in lockstep
+            spread = seconds * INTERVALJITTER
+        entry = [time() + seconds + uniform(0, spread), next(self._sequence), search]
+        self.entries[id(search)] = entry
+        heappush(self.heap, entry)
+        self._arm()
+
+    def unschedule(self, search):
+        entry = self.entries.pop(id(search), None)
+        if entry is None:
+            return
+        entry[2] = None
+        if len(self.heap) > 2 * len(self.entries) + 16:
+            self.heap = [queued for queued in self.heap if queued[2] is not None]
+            heapify(self.heap)
+
+    def searchStarted(self, search):
+        self.running.add(id(search))
+
+    def searchFinished(self, search):
+        if id(search) in self.running:
+            self.running.discard(id(search))
+            self._arm()
+
+    def getNextDue(self):
+        self._dropCancelled()
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][0]
+
+    def stop(self):
+        self._stopTimer()
+        self.heap = []
+        self.entries.clear()
+        self.running.clear()
+
+    def _startTimer(self, miliseconds):
+        raise NotImplementedError
+
+    def _stopTimer(self):
+        raise NotImplementedError
+
+    def _fire(self):
+        now = time()
+        while len(self.running) < self.maxConcurrent:
+            dueAt = self.getNextDue()
+            if dueAt is None or dueAt > now:
+                break
+            dueAt, sequence, search = heappop(self.heap)
+            self.entries.pop(id(search))
+            search._performSearch()
+        self._arm()
+
+    def _arm(self):
+        dueAt = self.getNextDue()
+        if dueAt is None or len(self.running) >= self.maxConcurrent:
+            self._stopTimer()
+            return
+        self._startTimer(max(int((dueAt - time()) * 1000), 0))
+
+    def _dropCancelled(self):
+        while len(self.heap) > 0 and self.heap[0][2] is None:
+            heappop(self.heap)
+
+
+class ThumbnailFetcher(object):
+    def __init__(self, deliver, concurrency=THUMBCONCURRENCY, rateLimiter=None, deriver=None):
+        self.deliver = deliver
+        self.rateLimiter = rateLimiter
+        self.deriver = deriver
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    def fetch(self, task):
+        self.executor.submit(self._fetch, task)
+
+    def _fetch(self, task):
+        thumbURL, videoID = task.task
+        if task.cancelled:
+            result = TaskResult(('Task cancelled', ErrorTypesEnum.Cancelled), TaskTypesEnum.error, taskID=task.taskID)
+            self.deliver(result)
+            return
+        limiter = self.rateLimiter
+        try:
+            if limiter is not None:
+                limiter.acquire(THUMBSHOST, TaskTypesEnum.thumb)
+            videoID, thumbPath = downloadThumbnail(thumbURL, videoID)
+            if limiter is not None:
+                limiter.reportSuccess(THUMBSHOST, TaskTypesEnum.thumb)
+            if self.deriver is not None:
+                thumbPath = self.deriver(thumbPath)
+            result = TaskResult((videoID, thumbPath), TaskTypesEnum.thumb, taskID=task.taskID)
+        except Exception as err:
+            if limiter is not None and isThrottlingError(err):
+                limiter.reportThrottled(THUMBSHOST, TaskTypesEnum.thumb)
+            result = TaskResult((str(err), ErrorTypesEnum.Other), TaskTypesEnum.error, taskID=task.taskID)
+        self.deliver(result)
+
+    def terminate(self):
+        self.executor.shutdown(wait=False)
+
+
+class TaskPool(object):
+    def __init__(self, minSearchers=MINSEARCHERS, maxSearchers=cpu_count(), thumbConcurrency=THUMBCONCURRENCY):
+        self.minSearchers = max(1, minSearchers)
+        self.maxSearchers = max(self.minSearchers, maxSearchers)
+        self.searchers = {}
+        self.tasks = TaskScheduler()
+        self.pending = {}
+        self.fetching = {}
+        self.flights = {}
+        self.carriers = {}
+        self.rateLimiter = RateLimiter(RATELIMITS, DEFAULTRATEKEY, WORKERCONTEXT)
+        self.thumbFetcher = ThumbnailFetcher(self._post, thumbConcurrency, self.rateLimiter)
+        self._searcherIDs = count()
+        self._taskIDs = count()
+        self.taskQueue = WORKERCONTEXT.Queue(self.maxSearchers * PREFETCHPERSEARCHER)
+        self.taskQueue.cancel_join_thread()
+        self.results = WORKERCONTEXT.Queue()
+        self.cancelled = WORKERCONTEXT.Array('q', [-1] * CANCELLEDSLOTS, lock=False)
+        self._cancelledIndex = 0
+        self._feeder = None
+        self.scheduler = None
+
+        self._stopping = 0
+        self._scaleUpTicks = 0
+        self._scaleDownTicks = 0
+        self._lastScaling = 0
+        self.waitAverage = 0.0
+        self.runAverage = 0.0
+        self.metrics = PoolMetrics()
+        self.metricsSources = {}
+        self.metricsPath = metricsPath
+        self._lastMetricsDump = time()
+
+        for i in range(self.minSearchers):
+            self.createRemoteSearcher()
+
+    @property
+    def activeSearchers(self):
+        return len(self.searchers) - self._stopping
+
+    @property
+    def capacity(self):
+        return self.activeSearchers * PREFETCHPERSEARCHER
+
+    def createRemoteSearcher(self):
+        sid = next(self._searcherIDs)
+        s = Searcher(sid, self.results, self.cancelled, self.rateLimiter)
+        self.searchers[sid] = s
+        s.prepareConnections(self.taskQueue)
+        s.start()
+        self.metrics.increment('searchersStarted')
+
+    def stopRemoteSearcher(self):
+        try:
+            self.taskQueue.put_nowait('')
+        except Full:
+            return False
+        self._stopping += 1
+        return True
+
+    def start(self):
+        if self._feeder is not None:
+            return
+        self._feeder = Thread(target=self._feedResults, name='PoolFeeder')
+        self._feeder.daemon = True
+        self._feeder.start()
+        self._startMaintenance()
+
+    def maintain(self):
+        self._reapSearchers()
+        self._autoscale()
+        self._dispatch()
+        if time() - self._lastMetricsDump >= METRICSDUMPINTERVAL:
+            self._lastMetricsDump = time()
+            try:
+                dumpMetrics(self.getMetrics(), self.metricsPath)
+            except OSError as err:
+                print('Metrics dump error', err)
+
+    def getMetrics(self):
+        metrics = self.metrics.snapshot()
+        now = time()
+        metrics['gauges'] = {'queued': self.tasks.getDepths(), 'inFlight': len(self.pending),
+                             'fetchingThumbs': len(self.fetching), 'coalescedFlights': len(self.flights),
+                             'activeSearchers': self.activeSearchers, 'stoppingSearchers': self._stopping,
+                             'waitAverage': round(self.waitAverage, 3), 'runAverage': round(self.runAverage, 3)}
+        workers = {}
+        for sid, s in self.searchers.items():
+            alive = max(now - s.startedAt, 0.001)
+            busy = s.busyTime.value
+            workers[str(sid)] = {'busy': round(busy, 3), 'idle': round(max(alive - busy, 0.0), 3),
+                                 'utilization': round(min(busy / alive, 1.0), 3),
+                                 'completed': self.metrics.completedByWorker.get(sid, 0)}
+        metrics['workers'] = workers
+        metrics['rates'] = {'{}/{}'.format(*key): round(rate, 3) for key, rate in self.rateLimiter.getRates().items()}
+        metrics['connections'] = getConnectionStats()
+        metrics['httpCache'] = getHTTPCache().getStats()
+        for name, source in self.metricsSources.items():
+            metrics[name] = source()
+        return metrics
+
+    def _reapSearchers(self):
+        for sid, s in list(self.searchers.items()):
+            if s.is_alive():
+                continue
+            s.join(0)
+            self.searchers.pop(sid)
+            if s.exitcode == 0 and self._stopping > 0:
+                self._stopping -= 1
+                self.metrics.increment('searchersStopped')
+                continue
+
+            self.metrics.increment('searchersCrashed')
+            print('Searcher {} died with exit code {}, replacing it'.format(sid, s.exitcode))
+            taskID = s.currentTask.value
+            task, callback = self.pending.pop(taskID, (None, None))
+            if task is not None:
+                reason = 'Searcher died with exit code {}'.format(s.exitcode)
+                self._replayTask(task, callback, TaskResult((reason, ErrorTypesEnum.Other), TaskTypesEnum.error,
+                                                            sid, taskID))
+            self.createRemoteSearcher()
+
+    def _replayTask(self, task, callback, errorResult):
+        task.attempts += 1
+        if task.attempts >= MAXTASKATTEMPTS:
+            self.metrics.increment('tasksDropped')
+            print('Task {} dropped after {} attempts'.format(task, task.attempts))
+            if callback is not None:
+                callback(errorResult)
+            return
+        self.metrics.increment('retries')
+        self.tasks.pushFront(task, callback)
+
+    def _autoscale(self):
+        active = self.activeSearchers
+        backlog = len(self.tasks)
+        if backlog > active or (backlog > 0 and self.waitAverage > SCALEUPWAIT):
+            self._scaleUpTicks += 1
+            self._scaleDownTicks = 0
+        elif backlog == 0 and len(self.pending) < active:
+            self._scaleDownTicks += 1
+            self._scaleUpTicks = 0
+        else:
+            self._scaleUpTicks = 0
+            self._scaleDownTicks = 0
+
+        now = time()
+        if now - self._lastScaling < SCALINGCOOLDOWN:
+            return
+
+        if active < self.minSearchers or (self._scaleUpTicks >= SCALEUPTICKS and active < self.maxSearchers):
+            self.createRemoteSearcher()
+            self._scaleUpTicks = 0
+            self._lastScaling = now
+        elif self._scaleDownTicks >= SCALEDOWNTICKS and active > self.minSearchers:
+            if self.stopRemoteSearcher():
+                self._scaleDownTicks = 0
+                self._lastScaling = now
+
+    def _feedResults(self):
+        while True:
+            try:
+                result = self.results.get()
+            except (EOFError, OSError, TypeError, ValueError):
+                # the queue was closed under us while terminating
+                return
+            if result is None:
+                return
+            self._post(result)
+
+    def _post(self, result):
+        raise NotImplementedError
+
+    def _startMaintenance(self):
+        raise NotImplementedError
+
+    def _stopMaintenance(self):
+        raise NotImplementedError
+
+    def onCrash(self, reason):
+        print('Pool crashed:', reason)
+
+    def appendTask(self, task, callback, timeout=None):
+        if not isinstance(task, PoolableTask):
+            raise TypeError('task to send must be of type \'PoolableTask\' not \'{}\''.format(type(task)))
+
+        handle = TaskHandle(self, task)
+        if timeout is not None:
+            task.deadline = time() + timeout
+
+        if task.taskType in COALESCEDTYPES:
+            task = self._joinFlights(task, callback)
+            if task is None:
+                return handle
+            callback = partial(self._landFlights, task)
+
+        if task.taskType == TaskTypesEnum.thumb:
+            task.taskID = next(self._taskIDs)
+            task.enqueuedAt = task.dispatchedAt = time()
+            self.fetching[task.taskID] = (task, callback)
+            self.thumbFetcher.fetch(task)
+        else:
+            self.tasks.push(task, callback)
+            self._dispatch()
+
+        return handle
+
+    def cancelTask(self, task):
+        if task.cancelled:
+            return
+        task.cancelled = True
+        self.metrics.increment('cancelled')
+        if task.taskID in self.pending:
+            self.cancelled[self._cancelledIndex] = task.taskID
+            self._cancelledIndex = (self._cancelledIndex + 1) % CANCELLEDSLOTS
+
+        for key in task.flightKeys:
+            flight = self.flights.get(key)
+            if flight is None:
+                continue
+            flight[:] = [waiter for waiter in flight if waiter[0] is not task]
+            carrier = self.carriers.get(key)
+            if carrier is not None and carrier is not task and not self._hasWaiters(carrier):
+                self.cancelTask(carrier)
+                self._releaseFlights(carrier)
+
+    def cancelTasks(self, owner=None):
+        requesters = {}
+        for flight in self.flights.values():
+            for task, callback in flight:
+                requesters[id(task)] = task
+        for task in self.tasks.iterTasks():
+            requesters[id(task)] = task
+        for taskMap in (self.pending, self.fetching):
+            for task, callback in taskMap.values():
+                requesters[id(task)] = task
+
+        carrierIDs = set(id(carrier) for carrier in self.carriers.values())
+        for task in list(requesters.values()):
+            if id(task) in carrierIDs:
+                continue
+            if owner is None or task.owner == owner:
+                self.cancelTask(task)
+
+    def _flightItems(self, task):
+        if task.taskType == TaskTypesEnum.thumb:
+            return [((TaskTypesEnum.thumb, task.task[1]), task.task)]
+        elif task.taskType == TaskTypesEnum.videos:
+            return [((TaskTypesEnum.video, url, task.fullInfo), url) for url in task.task]
+        else:
+            return [((TaskTypesEnum.video, task.task, task.fullInfo), task.task)]
+
+    def _joinFlights(self, task, callback):
+        newItems = []
+        newKeys = []
+        for key, item in self._flightItems(task):
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = []
+                newItems.append(item)
+                newKeys.append(key)
+            else:
+                self.metrics.increment('coalesced')
+            flight.append((task, callback))
+            task.flightKeys.append(key)
+
+        if len(newItems) == 0:
+            return None
+
+        carrier = task(newItems if task.taskType == TaskTypesEnum.videos else newItems[0], task.taskType)
+        carrier.deadline = task.deadline
+        carrier.flightKeys = newKeys
+        for key in newKeys:
+            self.carriers[key] = carrier
+        return carrier
+
+    def _hasWaiters(self, carrier):
+        for key in carrier.flightKeys:
+            if len(self.flights.get(key, ())) > 0:
+                return True
+        return False
+
+    def _isWaiting(self, task):
+        for key in task.flightKeys:
+            for waiter, callback in self.flights.get(key, ()):
+                if waiter is task:
+                    return True
+        return False
+
+    def _releaseFlights(self, carrier):
+        released = []
+        for key in carrier.flightKeys:
+            if self.carriers.get(key) is carrier:
+                self.carriers.pop(key)
+                released.extend(self.flights.pop(key, ()))
+        return released
+
+    def _landFlights(self, carrier, result):
+        taskType = result.taskType
+        if taskType == TaskTypesEnum.error:
+            waiters = {}
+            for task, callback in self._releaseFlights(carrier):
+                waiters[id(task)] = (task, callback)
+            for task, callback in waiters.values():
+                if not task.cancelled and callback is not None:
+                    callback(result)
+            return
+
+        if taskType == TaskTypesEnum.thumb:
+            items = [(carrier.flightKeys[0], result.data)]
+        elif taskType == TaskTypesEnum.videos:
+            items = [((TaskTypesEnum.video, url, carrier.fullInfo), (url, info)) for url, info in result.data]
+        else:
+            items = [(carrier.flightKeys[0], (carrier.task, result.data))]
+
+        deliveries = {}
+        for key, item in items:
+            for task, callback in self.flights.pop(key, ()):
+                delivery = deliveries.get(id(task))
+                if delivery is None:
+                    delivery = deliveries[id(task)] = (task, callback, [])
+                delivery[2].append(item)
+            self.carriers.pop(key, None)
+        for task, callback in self._releaseFlights(carrier):
+            # the searcher drops items it could not extract, their waiters still have to hear back
+            if id(task) not in deliveries and not self._isWaiting(task):
+                deliveries[id(task)] = (task, callback, [])
+
+        for task, callback, taskItems in deliveries.values():
+            if task.cancelled or callback is None:
+                continue
+            if task.taskType == TaskTypesEnum.videos:
+                callback(TaskResult(taskItems, TaskTypesEnum.videos, result.searcherID, result.taskID))
+            elif len(taskItems) == 0:
+                callback(TaskResult(('No info extracted for {}'.format(task.task), ErrorTypesEnum.Other),
+                                    TaskTypesEnum.error, result.searcherID, result.taskID))
+            elif task.taskType == TaskTypesEnum.video:
+                for url, info in taskItems:
+                    callback(TaskResult(info, TaskTypesEnum.video, result.searcherID, result.taskID))
+            else:
+                for data in taskItems:
+                    callback(TaskResult(data, taskType, result.searcherID, result.taskID))
+
+    def setFocusedOwner(self, owner):
+        self.tasks.setFocusedOwner(owner)
+
+    def setThumbDeriver(self, deriver):
+        self.thumbFetcher.deriver = deriver
+
+    def getQueueDepths(self):
+        return self.tasks.getDepths()
+
+    def _dispatch(self):
+        while len(self.tasks) > 0 and len(self.pending) < self.capacity:
+            task, callback = self.tasks.pop()
+            if task.cancelled:
+                continue
+            if task.deadline is not None and time() > task.deadline:
+                self.metrics.increment('expired')
+                if callback is not None:
+                    callback(TaskResult(('Task expired before dispatch', ErrorTypesEnum.Expired), TaskTypesEnum.error))
+                continue
+            task.taskID = next(self._taskIDs)
+            task.dispatchedAt = time()
+            try:
+                self.taskQueue.put_nowait(task)
+            except Full:
+                self.tasks.pushFront(task, callback)
+                break
+            except Exception as ex:
+                self.terminate()
+                self.onCrash(str(ex))
+                raise ex
+            self.metrics.taskDispatched(task)
+            self.pending[task.taskID] = (task, callback)
+
+    def _deliverResult(self, result):
+        try:
+            if isinstance(result, RemoteError):
+                # the searcher is exiting, _reapSearchers replaces it and replays its task
+                self.metrics.increment('searcherFailures')
+                print('Remote searcher failed:' + str(result.errorData))
+                return
+            if result.taskID in self.fetching:
+                task, callback = self.fetching.pop(result.taskID)
+                self.metrics.taskCompleted(task)
+            else:
+                task, callback = self.pending.pop(result.taskID, (None, None))
+                if task is not None:
+                    self._updateLatencies(task)
+                    self.metrics.taskCompleted(task, result.searcherID)
+            if task is not None and task.cancelled:
+                callback = None
+            if result.taskType == TaskTypesEnum.error:
+                self.metrics.increment('errors.' + result.data.errorType)
+                print('Remote error:' + str(result.data.errorData))
+                if result.data.errorType == ErrorTypesEnum.Other and result.searcherID is not None:
+                    if task is not None:
+                        self._replayTask(task, callback, result)
+                    callback = None
+            if callback is not None:
+                callback(result)
+        except Exception as ex:
+            self.terminate()
+            self.onCrash(str(ex))
+            raise ex
+
+        self._dispatch()
+
+    def _updateLatencies(self, task):
+        now = time()
+        waited = task.dispatchedAt - task.enqueuedAt
+        ran = now - task.dispatchedAt
+        self.waitAverage += (waited - self.waitAverage) * LATENCYSMOOTHING
+        self.runAverage += (ran - self.runAverage) * LATENCYSMOOTHING
+
+    def terminate(self):
+        self._stopMaintenance()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        self.thumbFetcher.terminate()
+        try:
+            self.results.put_nowait(None)
+        except (OSError, ValueError, AssertionError):
+            pass
+
+        for i in range(len(self.searchers)):
+            try:
+                self.taskQueue.put_nowait('')
+            except (Full, OSError, ValueError, AssertionError):
+                break
+        try:
+            self.taskQueue.close()
+        except (OSError, AssertionError):
+            pass
+
+        for s in self.searchers.values():
+            s.terminate()
+
+
+class AsyncTaskPool(TaskPool):
+    def __init__(self, loop, minSearchers=MINSEARCHERS, maxSearchers=cpu_count(), thumbConcurrency=THUMBCONCURRENCY):
+        self.loop = loop
+        self._maintenanceHandle = None
+        super(AsyncTaskPool, self).__init__(minSearchers, maxSearchers, thumbConcurrency)
+        self.scheduler = AsyncSearchScheduler(loop)
+
+    def _post(self, result):
+        try:
+            self.loop.call_soon_threadsafe(self._deliverResult, result)
+        except RuntimeError:
+            # the loop is already closed, nobody is waiting for the result
+            pass
+
+    def _startMaintenance(self):
+        self._maintenanceHandle = self.loop.call_later(MAINTENANCEINTERVAL / 1000, self._maintenanceTick)
+
+    def _stopMaintenance(self):
+        if self._maintenanceHandle is not None:
+            self._maintenanceHandle.cancel()
+            self._maintenanceHandle = None
+
+    def _maintenanceTick(self):
+        self.maintain()
+        self._startMaintenance()
+
+
+class AsyncSearchScheduler(SearchScheduler):
+    def __init__(self, loop, maxConcurrent=MAXCONCURRENTSEARCHES):
+        self.loop = loop
+        self._timerHandle = None
+        super(AsyncSearchScheduler, self).__init__(maxConcurrent)
+
+    def _startTimer(self, miliseconds):
+        self._stopTimer()
+        self._timerHandle = self.loop.call_later(miliseconds / 1000, self._fire)
+
+    def _stopTimer(self):
+        if self._timerHandle is not None:
+            self._timerHandle.cancel()
+            self._timerHandle = None
+
+
+class SearchWatcher(object):
+    def __init__(self, pool, deriver=None):
+        self.pool = pool
+        self.deriver = deriver
+        self.videoInfosCache = VideoInfoStore()
+        self.thumbsCache = self.videoInfosCache.getThumbs()
+        self.cacheManager = CacheManager(self.videoInfosCache, self.thumbsCache,
+                                         onThumbsEvicted=partial(self._callSoon, self.releaseThumbs))
+        if deriver is not None:
+            deriver = self.deriveThumb
+            self.pool.setThumbDeriver(deriver)
+        self.persistence = PersistenceQueue(self.videoInfosCache, cacheManager=self.cacheManager, deriver=deriver,
+                                            onThumbsDerived=partial(self._callSoon, self.applyDerivedThumbs))
+        self.pool.metricsSources['caches'] = self.cacheManager.getOccupancy
+        self.searches = {}
+        self.isClosed = False
+
+    def _callSoon(self, function, *args):
+        raise NotImplementedError
+
+    def _startMaintenance(self):
+        raise NotImplementedError
+
+    def _stopMaintenance(self):
+        raise NotImplementedError
+
+    def _createSearch(self, word, status):
+        return WatchedSearch(self.videoInfosCache, self.thumbsCache, self.videoDataArrived, self.thumbReady,
+                             self.pool, word, None, status)
+
+    def onVideoArrived(self, word, result):
+        pass
+
+    def onThumbReady(self, videoID):
+        pass
+
+    def onThumbsChanged(self, videoIDs):
+        pass
+
+    def start(self):
+        self.persistence.start()
+        # thumbnails stored before derivatives existed get theirs in the background
+        self.persistence.deriveThumbs([(videoID, thumbPath) for videoID, thumbPath in self.thumbsCache.items()
+                                       if not isDerivedThumb(thumbPath)])
+        self.pool.start()
+        self._startMaintenance()
+
+    def addSearch(self, word, settings=None, status=SearchStatesEnum.paused):
+        search = self._createSearch(word, status)
+        search.index = len(self.searches)
+        if settings is not None:
+            search.applySettings(settings)
+        self.searches[word] = search
+        return search
+
+    def removeSearch(self, word):
+        search = self.searches.pop(word)
+        search.terminate()
+        self.persistence.removeSearchSettings(word)
+        return search
+
+    def deriveThumb(self, thumbPath):
+        derivedPath = self.deriver(thumbPath)
+        # the store sizes and removes a thumbnail with every file written for it
+        self.videoInfosCache.recordThumbFiles([thumbPath, derivedPath])
+        return derivedPath
+
+    def getThumbPath(self, videoID):
+        thumbPath = self.thumbsCache.get(videoID)
+        if thumbPath is not None:
+            self.videoInfosCache.touch(videoID)
+        return thumbPath
+
+    def videoDataArrived(self, word, result):
+        if self.isClosed:
+            return
+        videoID = result['id']
+        if videoID not in self.videoInfosCache:
+            self.persistence.putVideoInfo(videoID, result)
+        self.onVideoArrived(word, result)
+
+    def thumbReady(self, result):
+        videoID, thumbPath = result
+        self.thumbsCache[videoID] = thumbPath
+        self.persistence.putThumb(videoID, thumbPath)
+        self.onThumbsChanged([videoID])
+        self.onThumbReady(videoID)
+
+    def getShownVideos(self):
+        shown = set()
+        for search in self.searches.values():
+            shown.update(search.currentResults.keys())
+        return shown
+
+    def evictCaches(self):
+        self.persistence.requestEviction(self.getShownVideos())
+
+    def releaseThumbs(self, videoIDs):
+        if self.isClosed:
+            return
+        released = self.cacheManager.releaseThumbs(videoIDs, self.getShownVideos())
+        self.onThumbsChanged(released)
+        self.persistence.removeThumbs(released)
+
+    def applyDerivedThumbs(self, items):
+        if self.isClosed:
+            return
+        changed = []
+        for videoID, thumbPath in items:
+            if videoID not in self.thumbsCache:
+                continue
+            self.thumbsCache[videoID] = thumbPath
+            self.persistence.putThumb(videoID, thumbPath)
+            changed.append(videoID)
+        self.onThumbsChanged(changed)
+
+    def dumpSearch(self, word):
+        self.persistence.putSearchSettings(word, self.searches[word].getSettings())
+
+    def dumpSearches(self):
+        for word in self.searches:
+            self.dumpSearch(word)
+
+    def stop(self):
+        self.isClosed = True
+        self._stopMaintenance()
+        self.dumpSearches()
+        self.pool.terminate()
+        for search in self.searches.values():
+            search.terminate()
+        self.persistence.stop()
+        self.videoInfosCache.close()
+
+
+class HeadlessWatcher(SearchWatcher):
+    def __init__(self, words=(), minSearchers=MINSEARCHERS, maxSearchers=cpu_count(), loop=None,
+                 videoCallback=None):
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.videoCallback = videoCallback
+        self._maintenanceHandle = None
+        super(HeadlessWatcher, self).__init__(AsyncTaskPool(self.loop, minSearchers, maxSearchers))
+        self.savedSettings = {}
+
+        for word, settings in loadSearchSettings():
+            self.savedSettings[word] = settings
+            self.addSearch(word, settings)
+        for word in words:
+            if word not in self.searches:
+                self.addSearch(word)
+
+    def _callSoon(self, function, *args):
+        try:
+            self.loop.call_soon_threadsafe(function, *args)
+        except RuntimeError:
+            # the loop is already closed
+            pass
+
+    def _startMaintenance(self):
+        self._maintenanceHandle = self.loop.call_soon(self._maintenanceTick)
+
+    def _stopMaintenance(self):
+        if self._maintenanceHandle is not None:
+            self._maintenanceHandle.cancel()
+            self._maintenanceHandle = None
+
+    def _maintenanceTick(self):
+        self.evictCaches()
+        self._maintenanceHandle = self.loop.call_later(CACHEMAINTENANCEINTERVAL / 1000, self._maintenanceTick)
+
+    def addSearch(self, word, settings=None, status=SearchStatesEnum.paused):
+        search = super(HeadlessWatcher, self).addSearch(word, settings, status)
+        if settings is None or settings.get('status') != SearchStatesEnum.paused:
+            search.setReady()
+        return search
+
+    def removeSearch(self, word):
+        self.savedSettings.pop(word, None)
+        return super(HeadlessWatcher, self).removeSearch(word)
+
+    def onVideoArrived(self, word, result):
+        if self.videoCallback is not None:
+            self.videoCallback(word, result)
+        else:
+            print('[{}] {} {}'.format(word, result.get('title'), result.get('webpage_url')))
+
+    def dumpSearch(self, word):
+        if word not in self.savedSettings:
+            # words given on the command line are not added to the desktop client's searches
+            return
+        settings = dict(self.savedSettings[word])
+        settings.update(self.searches[word].getSettings())
+        self.persistence.putSearchSettings(word, settings)
+
+    def run(self):
+        self.start()
+        try:
+            self.loop.add_signal_handler(SIGTERM, self.loop.stop)
+        except (NotImplementedError, RuntimeError):
+            pass
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        super(HeadlessWatcher, self).stop()
+        self.loop.close()
+
+
+def runHeadless(words=()):
+    HeadlessWatcher(words).run()
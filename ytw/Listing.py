@@ -1,16 +1,95 @@
 import datetime
 import webbrowser
+from collections import OrderedDict
 from operator import itemgetter
+from os import replace
 
 from PySide.QtCore import QRect, QSize, Qt, Signal, Slot
 from PySide.QtGui import *
 
+from .Caching import DERIVEDSUFFIX, TEMPEXT, isDerivedThumb
 from .Searching import SortingEnum
 from ._paths import *
 
 DEFAULT_DATE = '19800101'
 MAX_DESCRIPTION_LEN = 400
 THUMB_SIZE = 200
+PIXMAPCACHEBYTES = 64 * 1024 * 1024
+THUMBQUALITY = 85
+
+
+def fitsThumb(image):
+    return max(image.width(), image.height()) == THUMB_SIZE
+
+
+def makeThumbDerivative(thumbPath):
+    if isDerivedThumb(thumbPath):
+        return thumbPath
+    image = QImage(thumbPath)
+    if image.isNull():
+        return thumbPath
+    if not fitsThumb(image):
+        image = image.scaled(QSize(THUMB_SIZE, THUMB_SIZE), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    derivedPath = path.splitext(thumbPath)[0] + DERIVEDSUFFIX + '.jpg'
+    # written aside first, the thumbnails index prefers derivatives and must never pick a truncated one
+    tempPath = derivedPath + TEMPEXT
+    if not image.save(tempPath, 'JPG', THUMBQUALITY):
+        return thumbPath
+    try:
+        replace(tempPath, derivedPath)
+    except OSError as err:
+        print('Thumbnail derivative error', err)
+        return thumbPath
+    return derivedPath
+
+
+class PixmapCache(object):
+    def __init__(self, maxBytes=PIXMAPCACHEBYTES):
+        self.maxBytes = maxBytes
+        self.pixmaps = OrderedDict()
+        self.totalBytes = 0
+        self.stats = {'hits': 0, 'decoded': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self.pixmaps)
+
+    def get(self, key, filePath):
+        cached = self.pixmaps.get(key)
+        if cached is not None:
+            self.pixmaps.move_to_end(key)
+            self.stats['hits'] += 1
+            return cached[0]
+
+        pixmap = QPixmap(filePath)
+        if pixmap.isNull():
+            return None
+        self.stats['decoded'] += 1
+        self.put(key, pixmap)
+        return pixmap
+
+    def put(self, key, pixmap):
+        self.discard(key)
+        size = pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+        if size > self.maxBytes:
+            return
+        self.pixmaps[key] = (pixmap, size)
+        self.totalBytes += size
+        while self.totalBytes > self.maxBytes:
+            evictedKey, (evicted, evictedSize) = self.pixmaps.popitem(last=False)
+            self.totalBytes -= evictedSize
+            self.stats['evictions'] += 1
+
+    def discard(self, key):
+        cached = self.pixmaps.pop(key, None)
+        if cached is not None:
+            self.totalBytes -= cached[1]
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['entries'] = len(self.pixmaps)
+        stats['bytes'] = self.totalBytes
+        stats['maxBytes'] = self.maxBytes
+        return stats
 
 
 class VideoItem(QFrame):
@@ -115,7 +194,8 @@ class VideoItem(QFrame):
     def thumbArrived(self, videoID, retrieverFuction):
         if videoID == self.videoData['id']:
             newQpixmap = retrieverFuction(videoID)
-            self.thumb.setThumbPixmap(newQpixmap)
+            if newQpixmap is not None:
+                self.thumb.setThumbPixmap(newQpixmap)
 
     def setViewMode(self, mode):
         if mode == QListView.IconMode:
@@ -217,7 +297,11 @@ class Thumbnail(QWidget):
         self.setToolTip(desc)
 
     def setThumbPixmap(self, newQpixmap):
-        self.pixmap = newQpixmap.scaled(QSize(THUMB_SIZE, THUMB_SIZE), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        if fitsThumb(newQpixmap):
+            self.pixmap = newQpixmap
+        else:
+            self.pixmap = newQpixmap.scaled(QSize(THUMB_SIZE, THUMB_SIZE), Qt.KeepAspectRatio,
+                                            Qt.SmoothTransformation)
 
     def switchData(self, state):
         if state == 0:
@@ -277,6 +361,7 @@ class PreviewWidget(QWidget):
     searchPropertiesCheckChanged = Signal(bool)
     searchIndexChanged = Signal(str, int)
     sortingChanged = Signal()
+    searchEdited = Signal(object)
 
     def __init__(self, iconAdd, iconTools, iconSearch):
         super(PreviewWidget, self).__init__(parent=None)
@@ -401,6 +486,7 @@ class PreviewWidget(QWidget):
         search = listPreviews.search
         search.sorting = sortString
         self._doActualSorting(listPreviews, search)
+        self.searchEdited.emit(search)
 
     def sortItemsFromSearch(self, search):
         if self.isSetupSorting:
@@ -564,6 +650,7 @@ class PreviewWidget(QWidget):
         self._isChangingVieModeFromButton = False
         listPreviews.setViewMode(viewMode)
         self.updateItemsViewMode(listPreviews, viewMode)
+        self.searchEdited.emit(search)
 
     def setViewModeFromSearch(self, search):
         listPreviews = self.tabWidget.widget(self.findTabIndexByWord(search.word))
@@ -595,6 +682,7 @@ class PreviewWidget(QWidget):
         mode = search.viewMode
         listPreviews.setViewMode(mode)
         self.updateItemsViewMode(listPreviews, mode)
+        self.searchEdited.emit(search)
 
     @Slot(int)
     def _tabClosing(self, index):
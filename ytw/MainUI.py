@@ -1,13 +1,11 @@
 from __future__ import print_function
 
-from json import dump, load
+from functools import partial
 from multiprocessing import TimeoutError as PoolTimeOutError
-from os import listdir, mkdir, remove
+from os import mkdir, remove
 
 from .updateYT_DL import is_YTDL_importable, updateYTD
 
-CACHEFILEEXT = '.cache'
-
 WINDOWFILENAME = 'win.ini'
 
 RESTARTREQUIRED = False
@@ -18,6 +16,7 @@ if not is_YTDL_importable():
     except StopIteration:
         pass
 
+from .Caching import loadSearchSettings
 from .Listing import *
 from .Searching import *
 from ._paths import *
@@ -35,15 +34,19 @@ class MainWindow(QMainWindow):
         self.createFolderIfAbscent(CACHESPATH)
         self.createFolderIfAbscent(OPTIONSPATH)
 
-        self.videoInfosCache = {}
-        self.thumbsCache = {}
-        self.thumbnailPixmaps = {}
+        self.pixmapCache = PixmapCache()
 
         if not path.exists(CACHESPATH):
             mkdir(CACHESPATH)
 
-        self.loadVideoInfosCache()
-        self.loadThumbsCache()
+        self.mainPool = Pool(2, 6)
+        self.mainPool.poolCrashed.connect(self.poolCrashed)
+        self.mainPool.metricsSources['pixmaps'] = self.pixmapCache.getStats
+        self.watcher = Watcher(self.mainPool, makeThumbDerivative, self)
+        self.watcher.videoArrived.connect(self.videoDataArrived)
+        self.watcher.thumbArrived.connect(self.thumbArrived)
+        self.watcher.thumbsChanged.connect(self.discardPixmaps)
+        self.searches = self.watcher.searches
 
         self.searchers = {}
 
@@ -72,7 +75,6 @@ class MainWindow(QMainWindow):
         # self.statusBar().showMessage('Ready')
         self.resize(QSize(800, 600))
         self.center()
-        self.searches = {}
         self.lastArrivedWordResults = ''
 
         self.movieSearch.start()  # todo: start at first item addition
@@ -81,9 +83,7 @@ class MainWindow(QMainWindow):
         # self.timerConection.timeout.connect(self.checkConnection)
         # self.timerConection.start(5000)
 
-        self.mainPool = Pool(6)
-        self.mainPool.poolCrashed.connect(self.poolCrashed)
-        self.mainPool.start()
+        self.watcher.start()
         self.show()
         self.loadWindowsPlaces()
         self.loadSearches()
@@ -167,6 +167,7 @@ class MainWindow(QMainWindow):
         prevWid.tabChanged.connect(self.focusedSearchChanged)
         prevWid.searchPropertiesCheckChanged.connect(self.searchPropertiesBoxCheckedChanged)
         prevWid.searchIndexChanged.connect(self.searchIndexChanged)
+        prevWid.searchEdited.connect(self.searchEdited)
         prevWid.setObjectName('previewsWidget')
         self.previewsWidget = prevWid
 
@@ -178,6 +179,7 @@ class MainWindow(QMainWindow):
         self.searchBox = SearchPropertiesWidget(self)
         self.searchBox.setRadioIcons(self.iconReady, self.iconPaused)
         self.searchBox.searchSortingChanged.connect(self.updateSorting)
+        self.searchBox.searchEdited.connect(self.searchEdited)
         dockSearchProperties = QDockWidget()
         dockSearchProperties.setObjectName('dockSearchProperties')
         dockSearchProperties.visibilityChanged.connect(self.searchPropertiesBoxVsibilityChanged)
@@ -191,13 +193,20 @@ class MainWindow(QMainWindow):
         self.previewsWidget.clearList()
 
     def searchIndexChanged(self, word, index):
-        self.searches[word].index = index
+        search = self.searches[word]
+        search.index = index
+        self.searchEdited(search)
+
+    def searchEdited(self, search):
+        self.watcher.dumpSearch(search.word)
 
     def focusedSearchChanged(self, word):
         if word == '[no searches]':
             self.dockSearchProperties.setEnabled(False)
+            self.mainPool.setFocusedOwner(None)
         else:
             self.dockSearchProperties.setEnabled(True)
+            self.mainPool.setFocusedOwner(word)
             self.searchBox.refresh(self.searches[word])
 
     def newSearchRequested(self, word):
@@ -213,27 +222,20 @@ class MainWindow(QMainWindow):
                                    QMessageBox.No)
         if res == QMessageBox.No:
             return
-        fileName = '_' + word + CACHEFILEEXT
-        filePath = path.join(searchesPath, fileName)
-        if path.exists(filePath):
-            remove(filePath)
-        search = self.searches.pop(word)
+        search = self.watcher.removeSearch(word)
         self.previewsWidget.removeSearchTab(search)
-        search.terminate()
 
-    def createNewSearch(self, word, isPaused=False):
+    def createNewSearch(self, word, isPaused=False, settings=None):
         if isPaused:
             status = SearchStatesEnum.paused
         else:
             status = SearchStatesEnum.readyToSearch
 
-        search = Search(self.videoInfosCache, self.thumbsCache, self.videoDataArrived, self.thumbReady, self.mainPool,
-                        word, None, status)
+        search = self.watcher.addSearch(word, settings, status)
 
         search.reStartRequired.connect(self.restartRequired)
         search.shutdownRequired.connect(self.searchCrashed)
-
-        self.searches[word] = search
+        search.intervalChanged.connect(partial(self.searchIntervalChanged, search))
 
         if search.status == SearchStatesEnum.readyToSearch:
             icon = self.iconReady
@@ -246,16 +248,13 @@ class MainWindow(QMainWindow):
         return search
 
     def videoDataArrived(self, word, result):
-        videoID = result['id']
-        if videoID not in self.videoInfosCache.keys():
-            self.dumpVideoInfo(videoID, result)
-            self.videoInfosCache[videoID] = result
-
+        if self.closedPerformed:
+            return
         search = self.searches.get(word)
         if search is None:
             return
 
-        thumbPix = self.retrieveThumbnail(videoID)
+        thumbPix = self.retrieveThumbnail(result['id'])
         self.lastArrivedWordResults = word
         self.trayIcon.showMessage('New data', 'New data arrived for \'{}\''.format(word), millisecondsTimeoutHint=5000)
 
@@ -266,18 +265,25 @@ class MainWindow(QMainWindow):
         self.newThumbReady.connect(newVideoItem.thumbArrived)
 
     def retrieveThumbnail(self, videoID):
-        if videoID in self.thumbsCache.keys():
-            thumbPix = self.thumbnailPixmaps[videoID] = QPixmap(self.thumbsCache[videoID])
+        thumbPath = self.watcher.getThumbPath(videoID)
+        if thumbPath is not None:
+            thumbPix = self.pixmapCache.get(videoID, thumbPath)
         else:
             thumbPix = None
 
         return thumbPix
 
-    def thumbReady(self, result):
-        videoID, thumbPath = result
-        self.thumbsCache[videoID] = thumbPath
+    def thumbArrived(self, videoID):
         self.newThumbReady.emit(videoID, self.retrieveThumbnail)
 
+    def discardPixmaps(self, videoIDs):
+        for videoID in videoIDs:
+            self.pixmapCache.discard(videoID)
+
+    def searchIntervalChanged(self, search):
+        if self.searchBox.search is search:
+            self.searchBox.updatePrediction()
+
     def editSearchCallback(self, search):
         self.newSearchCallback(search, True)
 
@@ -299,12 +305,8 @@ class MainWindow(QMainWindow):
         self.closedPerformed = True
         self.previewsWidget.clear()
 
-        self.dumpSearches()
         self.saveWindowsPlaces()
-        self.mainPool.terminate()
-
-        for s in self.searches.values():
-            s.terminate()
+        self.watcher.stop()
 
         super(MainWindow, self).closeEvent(*args, **kwargs)
 
@@ -327,86 +329,15 @@ class MainWindow(QMainWindow):
         self.restoreState(settings.value('state'))
         # self.dockSearchProperties.setFloating(bool(settings.value('dock.floating')))
 
-    def dumpVideoInfo(self, videoID, info):
-        if path.exists(cachedInfosPath):
-            filenames = listdir(cachedInfosPath)
-
-            fileName = '_' + videoID + CACHEFILEEXT
-            if fileName not in filenames:
-                filePath = path.join(cachedInfosPath, fileName)
-                with open(filePath, 'x') as file:
-                    dump(info, file, indent=4)
-
-    def loadVideoInfosCache(self):
-        self.createFolderIfAbscent(cachedInfosPath)
-
-        for fileName in listdir(cachedInfosPath):
-            fpath = path.join(cachedInfosPath, fileName)
-            videoID, ext = path.splitext(fileName)
-            videoID = videoID[1:]
-            with open(fpath) as info:
-                infoDict = load(info)
-            self.videoInfosCache[videoID] = infoDict
-
-    def dumpSearches(self):
-        for word, s in self.searches.items():
-            fileName = '_' + word + CACHEFILEEXT
-            filePath = path.join(searchesPath, fileName)
-            if path.exists(filePath):
-                remove(filePath)
-            with open(filePath, 'w') as file:
-                searchInitDict = {'seconds' : s.seconds, 'status': s.status, 'excludeds': s.excludeds, 'unit': s.unit,
-                                  'index'   : s.index, 'searchMode': s.searchMode, 'max': s.maxResults,
-                                  'viewMode': s.viewMode.name.decode(), 'sorting': s.sorting}
-                dump(searchInitDict, file, indent=4)
-
     def loadSearches(self):
-        self.createFolderIfAbscent(searchesPath)
-        lastIndex = 0
-        lastChecked = 0
-
-        fileList = listdir(searchesPath)
-        while len(fileList) > 0:
-            fileName = fileList[lastChecked]
-            fpath = path.join(searchesPath, fileName)
-            word, ext = path.splitext(fileName)
-            word = word[1:]
-            with open(fpath) as info:
-                searchInitDict = load(info)
-                index = searchInitDict['index']
-                if index > lastIndex:
-                    lastChecked += 1
-                    continue
-                else:
-                    fileList.pop(lastChecked)
-                    lastIndex += 1
-                    lastChecked = 0
-                    status = searchInitDict['status']
-                    if status == SearchStatesEnum.paused:
-                        isPaused = True
-                    else:
-                        isPaused = False
-                    search = self.createNewSearch(word, True)
-                    search.seconds = searchInitDict['seconds']
-                    search.excludeds = searchInitDict['excludeds']
-                    search.unit = searchInitDict['unit']
-                    search.maxResults = searchInitDict['max']
-                    search.searchMode = searchInitDict['searchMode']
-                    search.viewMode = QListView.ViewMode.values[searchInitDict['viewMode']]
-                    search.sorting = searchInitDict['sorting']
-                    self.previewsWidget.setViewModeFromSearch(search)
-                    self.previewsWidget.setSortingModeFromSearch(search)
-                    if not isPaused:
-                        search.setReady()
-                        search.forceSearchNow()
-                    self.searchBox.refresh(search)
-
-    def loadThumbsCache(self):
-        self.createFolderIfAbscent(cachedThumbsPath)
-
-        for fileName in listdir(cachedThumbsPath):
-            videoID = fileName.split('_thumb')[0][1:]
-            self.thumbsCache[videoID] = path.join(cachedThumbsPath, fileName)
+        for word, searchInitDict in loadSearchSettings():
+            isPaused = searchInitDict['status'] == SearchStatesEnum.paused
+            search = self.createNewSearch(word, True, searchInitDict)
+            self.previewsWidget.setViewModeFromSearch(search)
+            self.previewsWidget.setSortingModeFromSearch(search)
+            if not isPaused:
+                search.setReady()
+            self.searchBox.refresh(search)
 
     def createFolderIfAbscent(self, folderPath):
         if not path.exists(folderPath):
@@ -449,6 +380,7 @@ def _pickleableCheck(dummy):
 
 class SearchPropertiesWidget(QWidget):
     searchSortingChanged = Signal()
+    searchEdited = Signal(object)
     wordChanged = Signal(str)
 
     def __init__(self, parent):
@@ -485,6 +417,20 @@ class SearchPropertiesWidget(QWidget):
         self.comboEveryUnit.currentIndexChanged.connect(self.updateTimeChanged)
         layoutForm.addRow(QLabel('Update every:'), layoutEvery)
 
+        self.checkAdaptive = QCheckBox('Adapt to activity')
+        self.checkAdaptive.toggled.connect(self.adaptiveChanged)
+        layoutForm.addRow(QLabel('Adaptive:'), self.checkAdaptive)
+
+        self.spinboxMaxInterval = QSpinBox()
+        self.spinboxMaxInterval.setRange(1, 24 * 60)
+        self.spinboxMaxInterval.setValue(60)
+        self.spinboxMaxInterval.setSuffix(' minutes')
+        self.spinboxMaxInterval.valueChanged.connect(self.adaptiveChanged)
+        layoutForm.addRow(QLabel('Slowest update:'), self.spinboxMaxInterval)
+
+        self.labelPrediction = QLabel()
+        layoutForm.addRow(QLabel('Next update:'), self.labelPrediction)
+
         self._internalReordering = True
         comboSearchMode = QComboBox()
         comboSearchMode.addItems(['Relevance', 'Date'])
@@ -523,9 +469,16 @@ class SearchPropertiesWidget(QWidget):
         self.searchSortingChanged.emit()
         if self.search.status != SearchStatesEnum.paused:
             self.search.forceSearchNow()
+        self.emitEdited()
 
     def changedMaxResults(self, val):
         self.search.maxResults = val
+        self.emitEdited()
+
+    def emitEdited(self):
+        # refresh() only mirrors the search into the widgets, there is nothing new to persist
+        if not self._onRefresh:
+            self.searchEdited.emit(self.search)
 
     def getRefreshTime(self):
         amount = self.spinboxRefreshTime.value()
@@ -574,7 +527,11 @@ class SearchPropertiesWidget(QWidget):
         self._internalReordering = True
         self.comboOrder.setCurrentIndex(search.searchMode)
         self.spinboxMaxResults.setValue(search.maxResults)
+        self.checkAdaptive.setChecked(search.adaptive)
+        self.spinboxMaxInterval.setValue(max(1, search.maxSeconds // 60))
+        self.spinboxMaxInterval.setEnabled(search.adaptive)
         self._internalReordering = False
+        self.updatePrediction()
 
         self._onRefresh = False
 
@@ -585,6 +542,7 @@ class SearchPropertiesWidget(QWidget):
             self.search.setPaused()
         else:
             self.search.setReady()
+        self.emitEdited()
 
     def excludedsChanged(self):
         text = self.editExcluded.toPlainText()
@@ -592,6 +550,30 @@ class SearchPropertiesWidget(QWidget):
             self.search.excludeds = text.split('\n')
         else:
             self.search.excludeds = []
+        self.emitEdited()
+
+    def adaptiveChanged(self):
+        self.spinboxMaxInterval.setEnabled(self.checkAdaptive.isChecked())
+        if self._internalReordering:
+            return
+        self.search.adaptive = self.checkAdaptive.isChecked()
+        self.search.maxSeconds = self.spinboxMaxInterval.value() * 60
+        self.search.resetTimer()
+        self.updatePrediction()
+        self.emitEdited()
+
+    def updatePrediction(self):
+        search = self.search
+        if search is None:
+            return
+        minutes = search.currentSeconds / 60
+        if not search.adaptive:
+            text = 'every {:.1f} minutes'.format(minutes)
+        elif search.arrivalRate is None:
+            text = 'every {:.1f} minutes (learning)'.format(minutes)
+        else:
+            text = 'every {:.1f} minutes, ~{:.1f} new videos expected'.format(minutes, search.predictedArrivals)
+        self.labelPrediction.setText(text)
 
     def updateTimeChanged(self):
         self.search.unit = self.comboEveryUnit.currentText().lower()
@@ -601,6 +583,8 @@ class SearchPropertiesWidget(QWidget):
             minval = 1
         self.spinboxRefreshTime.setMinimum(minval)
         self.search.seconds = self.getRefreshTime()
+        self.updatePrediction()
+        self.emitEdited()
 
     def close(self, *args, **kwargs):
         self._canceled = True
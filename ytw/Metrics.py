@@ -0,0 +1,74 @@
+from json import dump
+from os import makedirs, path, replace
+from time import time
+
+LATENCYBUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCYBUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def snapshot(self):
+        bounds = [str(b) for b in self.buckets] + ['inf']
+        return {'count': self.count, 'sum': round(self.total, 3), 'max': round(self.maximum, 3),
+                'mean': round(self.total / self.count, 3) if self.count else 0.0,
+                'buckets': dict(zip(bounds, self.counts))}
+
+
+class PoolMetrics(object):
+    def __init__(self):
+        self.counters = {}
+        self.latencies = {'wait': {}, 'run': {}, 'total': {}}
+        self.completedByWorker = {}
+        self.startedAt = time()
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage, taskType, seconds):
+        histograms = self.latencies[stage]
+        histogram = histograms.get(taskType)
+        if histogram is None:
+            histogram = histograms[taskType] = Histogram()
+        histogram.observe(max(seconds, 0.0))
+
+    def taskDispatched(self, task):
+        self.observe('wait', task.taskType, task.dispatchedAt - task.enqueuedAt)
+
+    def taskCompleted(self, task, searcherID=None):
+        now = time()
+        self.observe('run', task.taskType, now - task.dispatchedAt)
+        self.observe('total', task.taskType, now - task.enqueuedAt)
+        if searcherID is not None:
+            self.completedByWorker[searcherID] = self.completedByWorker.get(searcherID, 0) + 1
+
+    def snapshot(self):
+        latencies = {}
+        for stage, histograms in self.latencies.items():
+            latencies[stage] = {taskType: h.snapshot() for taskType, h in histograms.items()}
+        return {'uptime': round(time() - self.startedAt, 1), 'counters': dict(self.counters),
+                'latencies': latencies}
+
+
+def dumpMetrics(metrics, filePath):
+    folder = path.dirname(filePath)
+    if not path.exists(folder):
+        makedirs(folder)
+    tempPath = filePath + '.tmp'
+    with open(tempPath, 'w') as file:
+        dump(metrics, file, indent=4)
+    replace(tempPath, filePath)
@@ -1,34 +1,53 @@
-from multiprocessing import Process, Queue
+from collections import OrderedDict
+from multiprocessing import get_context
 from traceback import format_exc
 from queue import Empty, Full
-from time import time, sleep
-from os import path
+from time import time
 from urllib.error import *
+from urllib.parse import urlparse
 
 from .youtube_dl.YoutubeDL import YoutubeDL, ExtractorError
 from .youtube_dl.utils import *
 
-from .Downloading import download
-from ._paths import cachedThumbsPath
+from .Downloading import download, downloadThumbnail
+from .RateLimiting import isThrottlingError
 
 SORTINGDICT = {0: '', 1: 'Date'}
 MAXRETRIES = 3
+MAXCACHEDDOWNLOADERS = 4
+CANCELLEDSLOTS = 64
+SEARCHPAGESIZE = 20
+KNOWNRUNLENGTH = 3
+VIDEOFIELDS = ('id', 'title', 'webpage_url', 'thumbnail', 'description', 'uploader', 'uploader_url', 'upload_date',
+               'start_time', 'end_time', 'view_count', 'like_count', 'dislike_count', 'is_live', 'duration')
+# searchers are started while the parent runs threads, a forked child could inherit one of their held locks
+WORKERCONTEXT = get_context('spawn')
 
 
 class ErrorTypesEnum(object):
     NonValidData = 'NonValidData'
     PageNonAccesible = 'PageNonAccesible'
+    Cancelled = 'Cancelled'
+    Expired = 'Expired'
     Other = 'Other'
 
 
 class TaskTypesEnum(object):
     word = 'word'
     video = 'video'
+    videos = 'videos'
     thumb = 'thumb'
     data = 'data'
     error = 'error'
 
 
+YOUTUBEHOST = 'www.youtube.com'
+THUMBSHOST = 'i.ytimg.com'
+DEFAULTRATEKEY = (None, TaskTypesEnum.data)
+RATELIMITS = {(YOUTUBEHOST, TaskTypesEnum.word): (0.5, 2), (YOUTUBEHOST, TaskTypesEnum.video): (3.0, 6),
+              (THUMBSHOST, TaskTypesEnum.thumb): (20.0, 40), DEFAULTRATEKEY: (2.0, 4)}
+
+
 class NonValidDataError(BaseException):
     def __init__(self, msg, searchType, what):
         self.searchType = searchType
@@ -36,15 +55,32 @@ class NonValidDataError(BaseException):
         self.msg = str(msg)
 
 
-class Searcher(Process):
-    def __init__(self):
+class TaskCancelledError(BaseException):
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class Searcher(WORKERCONTEXT.Process):
+    def __init__(self, searcherID=None, results=None, cancelled=None, rateLimiter=None):
 
         super(Searcher, self).__init__()
 
+        self.searcherID = searcherID
+        self.taskID = None
+        self.currentTask = WORKERCONTEXT.Value('q', -1)
+        self.busyTime = WORKERCONTEXT.Value('d', 0.0)
+        self.startedAt = time()
+        self.cancelled = cancelled
+        self.rateLimiter = rateLimiter
+        self.deadline = None
+        self.videoFields = VIDEOFIELDS
+        self.knownIDs = None
         self.searchOrder = 'Date'
         self.searchMax = 50
-        self.local = Queue()
-        self.local.cancel_join_thread()
+        if results is None:
+            results = WORKERCONTEXT.Queue()
+            results.cancel_join_thread()
+        self.local = results
         self.remote = None
 
         self.thumbsCachePath = ''
@@ -52,20 +88,60 @@ class Searcher(Process):
         self._isRunning = True
         self.externalPause = False
 
+        self.downloader = None
+        self.searchExtractor = None
+        self.resultsExtractor = None
+        self._downloaders = OrderedDict()
+
+    def prepareDownloaders(self):
         self.downloader = self.createDownloader()
         self.searchExtractor = self.createSearcher()
         self.resultsExtractor = self.downloader.get_info_extractor('Youtube')
+        self._downloaders.clear()
+        self._downloaders[(self.searchOrder, self.searchMax)] = (self.downloader, self.searchExtractor)
 
     def createDownloader(self):
         sorting = 'ytsearch'
         if self.searchOrder == 'Date':
             sorting += 'date'
-        ytOptions = {'logger': MyLogger(), 'progress_hooks': [my_hook], 'default_search': sorting + str(self.searchMax)}
+        ytOptions = {'logger': MyLogger(self.checkCancelled), 'progress_hooks': [my_hook], 'default_search': sorting + str(self.searchMax)}
         return YoutubeDL(ytOptions)
 
     def createSearcher(self):
         return self.downloader.get_info_extractor('YoutubeSearch' + self.searchOrder)
 
+    def useDownloader(self, searchOrder, searchMax):
+        key = (searchOrder, searchMax)
+        self.searchOrder = searchOrder
+        self.searchMax = searchMax
+        prepared = self._downloaders.pop(key, None)
+        if prepared is None:
+            self.downloader = self.createDownloader()
+            prepared = (self.downloader, self.createSearcher())
+            if len(self._downloaders) >= MAXCACHEDDOWNLOADERS:
+                self._downloaders.popitem(last=False)
+        self._downloaders[key] = prepared
+        self.downloader, self.searchExtractor = prepared
+
+    def checkCancelled(self):
+        if self.deadline is not None and time() > self.deadline:
+            raise TaskCancelledError(ErrorTypesEnum.Expired)
+        if self.cancelled is not None and self.taskID in self.cancelled[:]:
+            raise TaskCancelledError(ErrorTypesEnum.Cancelled)
+
+    def limited(self, host, taskType, function, *args):
+        if self.rateLimiter is None:
+            return function(*args)
+        self.rateLimiter.acquire(host, taskType, self.checkCancelled)
+        try:
+            result = function(*args)
+        except Exception as err:
+            if isThrottlingError(err):
+                self.rateLimiter.reportThrottled(host, taskType)
+            raise
+        self.rateLimiter.reportSuccess(host, taskType)
+        return result
+
     def prepareConnections(self, remote):
         self.remote = remote
         return self.local
@@ -73,39 +149,80 @@ class Searcher(Process):
     def search(self, what, searchType):
         try:
             if searchType == TaskTypesEnum.word:
+                if self.knownIDs and self.searchOrder == 'Date':
+                    return self.searchIncrementally(what)
                 ydl = self.downloader
                 query = ydl.get_info_extractor('Generic').extract(what)
                 url = query['url']
                 searchExtractor = self.searchExtractor
-                result = searchExtractor.extract(url)
+                result = self.limited(YOUTUBEHOST, TaskTypesEnum.word, searchExtractor.extract, url)
                 ydl.add_default_extra_info(result, searchExtractor, url)
+                result['entries'] = list(result['entries'])
                 return result
             elif searchType == TaskTypesEnum.video:
-                resultsExtractor = self.resultsExtractor
-                videoInfo = resultsExtractor.extract(what)
-                if not self.hasEssentialData(videoInfo):
-                    raise NonValidDataError('Null uploader', searchType, what)
-                if videoInfo['like_count'] is None:
-                    videoInfo['like_count'] = 0
-                if videoInfo['dislike_count'] is None:
-                    videoInfo['dislike_count'] = 0
-                return videoInfo
+                return self.extractVideoInfo(what)
+            elif searchType == TaskTypesEnum.videos:
+                return self.extractVideoInfos(what)
             elif searchType == TaskTypesEnum.thumb:
                 thumbURL, videoID = what
-                binaryThumb = download(thumbURL)
-                thumbExt = path.splitext(path.basename(thumbURL))[1]
-                thumbPath = path.join(cachedThumbsPath, '_' + videoID + '_thumb' + thumbExt)
-                try:
-                    with open(thumbPath, 'xb') as thumbFile:
-                        thumbFile.write(binaryThumb)
-                except FileExistsError:
-                    pass
-                return videoID, thumbPath
+                return self.limited(THUMBSHOST, TaskTypesEnum.thumb, downloadThumbnail, thumbURL, videoID)
             else:  # searchType == TaskTypesEnum.data:
-                binaryData = download(what)
+                binaryData = self.limited(urlparse(what).hostname, TaskTypesEnum.data, download, what)
                 return binaryData
         except Exception:
-            remoteRaise(self.local)
+            remoteRaise(self.local, self.searcherID, self.taskID)
+
+    def searchIncrementally(self, word):
+        known = set(self.knownIDs)
+        runLength = min(KNOWNRUNLENGTH, len(known))
+        url = 'ytsearchdate{}:{}'.format(self.searchMax, word)
+        result = self.limited(YOUTUBEHOST, TaskTypesEnum.word, self.searchExtractor.extract, url)
+        self.downloader.add_default_extra_info(result, self.searchExtractor, url)
+        # youtube_dl yields search entries lazily and only requests the next page when the current one is used up
+        isLazy = not isinstance(result['entries'], list)
+        entries = []
+        knownRun = 0
+        for entry in result['entries']:
+            entries.append(entry)
+            if entry['id'] not in known:
+                knownRun = 0
+            else:
+                knownRun += 1
+                if knownRun >= runLength:
+                    result['entries'] = [new for new in entries if new['id'] not in known]
+                    return result
+            if isLazy and len(entries) % SEARCHPAGESIZE == 0 and len(entries) < self.searchMax:
+                self.checkCancelled()
+                if self.rateLimiter is not None:
+                    self.rateLimiter.acquire(YOUTUBEHOST, TaskTypesEnum.word, self.checkCancelled)
+        result['entries'] = entries
+        return result
+
+    def extractVideoInfo(self, url):
+        videoInfo = self.limited(YOUTUBEHOST, TaskTypesEnum.video, self.resultsExtractor.extract, url)
+        if not self.hasEssentialData(videoInfo):
+            raise NonValidDataError('Null uploader', TaskTypesEnum.video, url)
+        if videoInfo['like_count'] is None:
+            videoInfo['like_count'] = 0
+        if videoInfo['dislike_count'] is None:
+            videoInfo['dislike_count'] = 0
+        if self.videoFields is not None:
+            videoInfo = projectVideoInfo(videoInfo, self.videoFields)
+        return videoInfo
+
+    def extractVideoInfos(self, urls):
+        videoInfos = []
+        lastError = None
+        for url in urls:
+            self.checkCancelled()
+            try:
+                videoInfos.append((url, self.extractVideoInfo(url)))
+            except (NonValidDataError, YoutubeDLError) as err:
+                print('Skipped video {}: {}'.format(url, err))
+                lastError = err
+        if len(videoInfos) == 0 and lastError is not None:
+            raise lastError
+        return videoInfos
 
     def hasEssentialData(self, videoInfo):
         try:
@@ -114,11 +231,12 @@ class Searcher(Process):
             else:
                 return True
         except KeyError:
-            remoteRaise(self.local)
+            return False
 
     def run(self):
         data = None
         retries = 0
+        self.prepareDownloaders()
         while self._isRunning:
             try:
                 if data is None:
@@ -143,27 +261,39 @@ class Searcher(Process):
                     if self.externalPause:
                         continue
 
-                    self.searchOrder = SORTINGDICT[data.sorting]
-                    self.searchMax = data.maxResults
-                    self.downloader = self.createDownloader()
-                    self.searchExtractor = self.createSearcher()
+                    self.taskID = data.taskID
+                    self.deadline = data.deadline
+                    self.videoFields = None if data.fullInfo else VIDEOFIELDS
+                    self.knownIDs = data.knownIDs
+                    self.currentTask.value = data.taskID
+                    self.useDownloader(SORTINGDICT[data.sorting], data.maxResults)
 
                     query, searchType = data
+                    taskStarted = time()
                     try:
+                        self.checkCancelled()
                         result = self.search(query, searchType)
                         data = None
                         if result is not None:
-                            self.local.put(TaskResult(result, searchType))
+                            self.local.put(TaskResult(result, searchType, self.searcherID, self.taskID))
+                        self.currentTask.value = -1
                     except (NonValidDataError, YoutubeDLError):
                         retries += 1
                         if retries == MAXRETRIES:
-                            remoteRaise(self.local)
-                        else:
-                            sleep(1)
+                            remoteRaise(self.local, self.searcherID, self.taskID)
+                            data = None
+                            self.currentTask.value = -1
+                    except TaskCancelledError as err:
+                        data = None
+                        self.currentTask.value = -1
+                        self.local.put(TaskResult(('Task cancelled', err.reason), TaskTypesEnum.error, self.searcherID,
+                                                  self.taskID))
                     except Exception:
-                        remoteRaise(self.local)
+                        remoteRaise(self.local, self.searcherID, self.taskID)
                         self.terminate()
                         raise
+                    finally:
+                        self.busyTime.value += time() - taskStarted
 
             except Exception:
                 self._isRunning = False
@@ -171,7 +301,7 @@ class Searcher(Process):
                     self.local.put_nowait(RemoteError(format_exc(), ErrorTypesEnum.Other))
                 except Exception:
                     pass
-                remoteRaise(self.local)
+                remoteRaise(self.local, self.searcherID, self.taskID)
                 self.terminate()
                 raise
 
@@ -187,7 +317,7 @@ class Searcher(Process):
             pass
 
 
-def remoteRaise(queue):
+def remoteRaise(queue, searcherID=None, taskID=None):
     eType, instance, tb = sys.exc_info()
     if eType == NonValidDataError:
         errorType = ErrorTypesEnum.NonValidData
@@ -205,16 +335,25 @@ def remoteRaise(queue):
     else:
         errorType = ErrorTypesEnum.Other
         data = str(instance)
-    queue.put_nowait(TaskResult((data, errorType), TaskTypesEnum.error))
+    queue.put_nowait(TaskResult((data, errorType), TaskTypesEnum.error, searcherID, taskID))
 
 
 def isRemoteError(result):
     return isinstance(result, NonValidDataError) or issubclass(type(result), YoutubeDL)
 
 
+def projectVideoInfo(videoInfo, fields=VIDEOFIELDS):
+    return {field: videoInfo.get(field) for field in fields}
+
+
 class MyLogger(object):
+    def __init__(self, checkpoint=None):
+        self.checkpoint = checkpoint
+
     def debug(self, msg):
-        pass
+        # youtube_dl reports every extraction step here, which makes it a good place to abort cancelled tasks
+        if self.checkpoint is not None:
+            self.checkpoint()
 
     def warning(self, msg):
         print('Downloader warning: ' + msg)
@@ -231,8 +370,10 @@ def my_hook(d):
 
 
 class TaskResult(object):
-    def __init__(self, result, taskType):
+    def __init__(self, result, taskType, searcherID=None, taskID=None):
         self.taskType = taskType
+        self.searcherID = searcherID
+        self.taskID = taskID
         if taskType == TaskTypesEnum.error:
             finalData = RemoteError(*result)
         else:
@@ -0,0 +1,108 @@
+import multiprocessing
+from random import uniform
+from time import sleep, time
+
+BASEBACKOFF = 1.0
+MAXBACKOFF = 120.0
+MAXWAITSTEP = 0.5
+RECOVERYFACTOR = 0.05
+MINRATEFACTOR = 0.05
+
+TOKENS, REFILLED, RATE, BACKOFFUNTIL, STRIKES = range(5)
+FIELDS = 5
+
+
+class RateLimiter(object):
+    def __init__(self, limits, defaultKey=None, context=multiprocessing):
+        self.limits = dict(limits)
+        self.slots = {}
+        self.defaultKey = defaultKey
+        self.state = context.Array('d', len(self.limits) * FIELDS)
+        now = time()
+        for i, (key, (rate, burst)) in enumerate(self.limits.items()):
+            self.slots[key] = i
+            self._set(i, TOKENS, burst)
+            self._set(i, REFILLED, now)
+            self._set(i, RATE, rate)
+
+    def acquire(self, host, taskType, checkpoint=None):
+        key = self._getKey(host, taskType)
+        if key is None:
+            return
+        slot = self.slots[key]
+        baseRate, burst = self.limits[key]
+        while True:
+            with self.state.get_lock():
+                now = time()
+                self._refill(slot, burst, now)
+                backoffUntil = self._get(slot, BACKOFFUNTIL)
+                tokens = self._get(slot, TOKENS)
+                if now >= backoffUntil and tokens >= 1:
+                    self._set(slot, TOKENS, tokens - 1)
+                    return
+                wait = max(backoffUntil - now, (1 - tokens) / self._get(slot, RATE))
+            sleep(min(wait, MAXWAITSTEP))
+            if checkpoint is not None:
+                checkpoint()
+
+    def reportThrottled(self, host, taskType):
+        key = self._getKey(host, taskType)
+        if key is None:
+            return
+        slot = self.slots[key]
+        baseRate, burst = self.limits[key]
+        with self.state.get_lock():
+            now = time()
+            strikes = self._get(slot, STRIKES) + 1
+            delay = min(MAXBACKOFF, BASEBACKOFF * 2 ** strikes) * uniform(0.5, 1.5)
+            self._set(slot, STRIKES, strikes)
+            self._set(slot, BACKOFFUNTIL, max(self._get(slot, BACKOFFUNTIL), now + delay))
+            self._set(slot, RATE, max(baseRate * MINRATEFACTOR, self._get(slot, RATE) / 2))
+            self._set(slot, TOKENS, 0)
+
+    def reportSuccess(self, host, taskType):
+        key = self._getKey(host, taskType)
+        if key is None:
+            return
+        slot = self.slots[key]
+        baseRate, burst = self.limits[key]
+        with self.state.get_lock():
+            self._set(slot, STRIKES, max(0, self._get(slot, STRIKES) - 1))
+            self._set(slot, RATE, min(baseRate, self._get(slot, RATE) + baseRate * RECOVERYFACTOR))
+
+    def getRates(self):
+        with self.state.get_lock():
+            return {key: self._get(slot, RATE) for key, slot in self.slots.items()}
+
+    def _refill(self, slot, burst, now):
+        elapsed = now - self._get(slot, REFILLED)
+        tokens = min(burst, self._get(slot, TOKENS) + elapsed * self._get(slot, RATE))
+        self._set(slot, TOKENS, tokens)
+        self._set(slot, REFILLED, now)
+
+    def _getKey(self, host, taskType):
+        key = (host, taskType)
+        if key in self.slots:
+            return key
+        return self.defaultKey
+
+    def _get(self, slot, field):
+        return self.state[slot * FIELDS + field]
+
+    def _set(self, slot, field, value):
+        self.state[slot * FIELDS + field] = value
+
+
+def isThrottlingError(error, depth=5):
+    if error is None or depth == 0:
+        return False
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status', None) == 429:
+        return True
+    message = str(error)
+    if '429' in message or 'Too Many Requests' in message:
+        return True
+    cause = getattr(error, 'cause', None)
+    if cause is None:
+        excInfo = getattr(error, 'exc_info', None)
+        cause = excInfo[1] if excInfo else None
+    return isThrottlingError(cause, depth - 1)
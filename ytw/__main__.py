@@ -1,4 +1,13 @@
-from ytw.MainUI import runMainWindow
+from sys import argv
 
 if __name__ == '__main__':
-    runMainWindow()
+    args = argv[1:]
+    if '--headless' in args:
+        from ytw.updateYT_DL import is_YTDL_importable, updateYTD
+        if not is_YTDL_importable():
+            list(updateYTD(noCheck=True, showMessage=False))
+        from ytw.Engine import runHeadless
+        runHeadless([arg for arg in args if arg != '--headless'])
+    else:
+        from ytw.MainUI import runMainWindow
+        runMainWindow()
@@ -12,6 +12,9 @@ CACHESPATH = path.abspath(path.join(currentDir, 'caches'))
 OPTIONSPATH = path.abspath(path.join(currentDir, 'options'))
 
 cachedInfosPath = path.join(CACHESPATH, 'infos')
+videoInfosDBPath = path.join(CACHESPATH, 'infos.sqlite')
 searchesPath = path.join(OPTIONSPATH, 'searches')
 cachedThumbsPath = path.join(CACHESPATH, 'thumbs')
 
+httpCachePath = path.join(CACHESPATH, 'http')
+metricsPath = path.join(CACHESPATH, 'metrics.json')
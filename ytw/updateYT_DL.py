@@ -1,8 +1,6 @@
 from json import loads
 from os import path, remove, listdir, makedirs
 
-from PySide.QtGui import QMessageBox
-
 from .Downloading import download
 from ._paths import CACHESPATH
 
@@ -35,7 +33,7 @@ def updateYTD(noCheck=False, showMessage=True, useYield=False):
             else:
                 return
         CHECKED = True
-        data = download('https://api.github.com/repos/rg3/youtube-dl/releases/latest')
+        data = download('https://api.github.com/repos/rg3/youtube-dl/releases/latest', useCache=True)
         parsedData = loads(data.decode('utf-8'))
 
         remoteVersion = parsedData['tag_name']
@@ -59,6 +57,7 @@ def updateYTD(noCheck=False, showMessage=True, useYield=False):
 
             message = 'Youtube-DL is {}.\n'.format(reason) + 'New version ({}) will be downloaded now.'.format(remoteVersion)
             if showMessage:
+                from PySide.QtGui import QMessageBox
                 QMessageBox.warning(None, 'Tool {}'.format(reason), message, QMessageBox.Ok)
             else:
                 print(message)